@@ -8,19 +8,34 @@ from dotenv import load_dotenv
 import os
 import faiss
 import json
+from typing import Any, NamedTuple
 from sentence_transformers import SentenceTransformer # Added for FAISS embeddings
+from deadlines import Deadline, DeadlineExceeded, LLM_MIN_BUDGET_SECONDS, QUERY_DEADLINE_SECONDS
+from chunk_filters import ChunkAttributes, filtered_search
+from dedup import dedup_chunks, DEFAULT_MAX_DISTANCE
+from llm_scheduler import SingleFlight, normalize_question, scheduler_from_env, PRIORITY_INTERACTIVE
 
 load_dotenv() # Load environment variables, including your GOOGLE_API_KEY
 
+class LoadedIndex(NamedTuple):
+    """Everything a query reads about the loaded session; replaced as a whole, never field by field."""
+    faiss_index: Any
+    metadata: dict
+    chunk_attributes: ChunkAttributes
+
 class LocalRAGSystemFAISS: # Changed class name to reflect FAISS
     def __init__(self, llm_model_name: str = "gemini-2.5-flash"):
        
         self.embedding_model = SentenceTransformer("all-MiniLM-L6-v2") # SentenceTransformer for FAISS
         self.conversation_chains = {}
-        self.llm = GoogleGenerativeAI(model=llm_model_name)
-        self.faiss_index = None # Will hold the FAISS index
-        self.metadata = None    # Will hold the associated text content (from meta.json)
+        self.llm = GoogleGenerativeAI(model=llm_model_name, timeout=QUERY_DEADLINE_SECONDS) # Bounds abandoned (hedged or timed out) calls too
+        # FAISS index, its meta.json and the array-backed chunk attributes for filtered search.
+        # Uploads and session loads swap in a new LoadedIndex with one assignment while queries
+        # run on other threads, so a query never pairs one session's index with another's metadata.
+        self.loaded = None
         self.qa_chain = None
+        self.single_flight = SingleFlight() # Merges identical in-flight questions per session
+        self.llm_scheduler = scheduler_from_env() # Caps and paces concurrent Gemini calls
         self.custom_whatsapp_prompt_template = """
                 You are a helpful assistant that can answer questions about IIT Mandi and JOSAA counselling
                 based on the provided context from a chat transcript.
@@ -43,6 +58,23 @@ class LocalRAGSystemFAISS: # Changed class name to reflect FAISS
                 Your answers should not be too verbose keep them crisp but inlcude all important detail.
                 """
         
+    @property
+    def faiss_index(self):
+        return self.loaded.faiss_index if self.loaded else None
+
+    @property
+    def metadata(self):
+        return self.loaded.metadata if self.loaded else None
+
+    @property
+    def chunk_attributes(self):
+        return self.loaded.chunk_attributes if self.loaded else None
+
+    def _swap_in(self, faiss_index, metadata: dict) -> dict:
+        """Makes a built or loaded index current and returns its dedup stats."""
+        self.loaded = LoadedIndex(faiss_index, metadata, ChunkAttributes(metadata["chunks"]))
+        return metadata.get("dedup")
+
     def get_chain(self, conversation_id: str):
         if conversation_id not in self.conversation_chains:
             memory = ConversationBufferMemory(
@@ -63,18 +95,36 @@ class LocalRAGSystemFAISS: # Changed class name to reflect FAISS
         return self.conversation_chains[conversation_id]
 
 
-    def _create_and_save_faiss_index(self, file_path: str, faiss_index_path: str, meta_path: str, chunk_size: int = 1000, chunk_overlap: int = 100):
+    def _create_and_save_faiss_index(self, file_path: str, faiss_index_path: str, meta_path: str, chunk_size: int = 1000, chunk_overlap: int = 100, dedup_max_distance: int = DEFAULT_MAX_DISTANCE):
 
         print(f"Creating FAISS index and metadata from: {file_path}")
         loader = TextLoader(file_path, encoding="utf-8")
         raw_documents = loader.load()
 
-        text_splitter = RecursiveCharacterTextSplitter(chunk_size=chunk_size, chunk_overlap=chunk_overlap)
+        text_splitter = RecursiveCharacterTextSplitter(chunk_size=chunk_size, chunk_overlap=chunk_overlap, add_start_index=True)
         docs = text_splitter.split_documents(raw_documents)
+        return self._index_documents(docs, faiss_index_path, meta_path, dedup_max_distance)
+
+    def create_index_from_texts(self, texts: list, metadatas: list, faiss_index_path: str, meta_path: str, chunk_size: int = 1000, chunk_overlap: int = 100, dedup_max_distance: int = DEFAULT_MAX_DISTANCE, embed_batch_size: int = 128):
+        """
+        Builds one index over many already-extracted texts (e.g. every page of every file in a batch upload).
+        Each chunk keeps the metadata of the text it came from, such as its source file and page.
+        Returns the dedup stats of this build.
+        """
+        print(f"Creating FAISS index and metadata from {len(texts)} texts")
+        text_splitter = RecursiveCharacterTextSplitter(chunk_size=chunk_size, chunk_overlap=chunk_overlap, add_start_index=True)
+        docs = text_splitter.create_documents(texts, metadatas=metadatas)
+        return self._swap_in(*self._index_documents(docs, faiss_index_path, meta_path, dedup_max_distance, embed_batch_size))
+
+    def _index_documents(self, docs: list, faiss_index_path: str, meta_path: str, dedup_max_distance: int = DEFAULT_MAX_DISTANCE, embed_batch_size: int = 32):
+        # Collapse repeated headers, footers and forwarded messages before embedding them.
+        # A negative dedup_max_distance never matches, which keeps every chunk.
+        docs, positions, dedup_stats = dedup_chunks(docs, dedup_max_distance)
+        print(f"Dedup: kept {dedup_stats['unique_chunks']} of {dedup_stats['total_chunks']} chunks (ratio {dedup_stats['dedup_ratio']})")
 
         texts = [doc.page_content for doc in docs]
         
-        embeddings = self.embedding_model.encode(texts).astype('float32')
+        embeddings = self.embedding_model.encode(texts, batch_size=embed_batch_size).astype('float32')
 
         dimension = embeddings.shape[1]
         faiss_index = faiss.IndexFlatL2(dimension) # Using L2 (Euclidean) distance for similarity
@@ -82,45 +132,85 @@ class LocalRAGSystemFAISS: # Changed class name to reflect FAISS
 
         faiss.write_index(faiss_index, faiss_index_path)
 
-        # Prepare metadata (list of dictionaries, each with 'text_preview' and potentially other info)
-        metadata_list = [{"text_preview": text, "source": doc.metadata.get('source', 'N/A')} for text, doc in zip(texts, docs)]
+        # Prepare metadata (list of dictionaries, each with 'text_preview', its source metadata and every original position it stands for)
+        metadata_list = [
+            {"text_preview": text, "source": "N/A", **doc.metadata, "positions": pos}
+            for text, doc, pos in zip(texts, docs, positions)
+        ]
+        metadata = {"chunks": metadata_list, "dedup": dedup_stats} # Wrap in "chunks" key for consistency
         
         with open(meta_path, "w", encoding="utf-8") as f:
-            json.dump({"chunks": metadata_list}, f, indent=4) # Wrap in "chunks" key for consistency
+            json.dump(metadata, f, indent=4)
         print(f"Metadata saved to {meta_path}")
-        return faiss_index, {"chunks": metadata_list}
+        return faiss_index, metadata
 
     def load_faiss_index_and_metadata(self, faiss_index_path: str = "faiss_index.idx", meta_path: str = "meta.json", file_path: str = "RagAPI/common.txt"):
-    
+        """Loads (or builds, if missing) an index and its metadata and makes them current. Returns their dedup stats."""
         if not os.path.exists(faiss_index_path) or not os.path.exists(meta_path):
-            self.faiss_index, self.metadata = self._create_and_save_faiss_index(file_path, faiss_index_path, meta_path)
+            faiss_index, metadata = self._create_and_save_faiss_index(file_path, faiss_index_path, meta_path)
         else:
-            self.faiss_index = faiss.read_index(faiss_index_path)
+            faiss_index = faiss.read_index(faiss_index_path)
             with open(meta_path, "r", encoding="utf-8") as f:
-                self.metadata = json.load(f)
+                metadata = json.load(f)
+        return self._swap_in(faiss_index, metadata)
+
+    def get_response_from_query(self, query: str, conversation_id: str, k: int = 12, priority: int = PRIORITY_INTERACTIVE, filters: dict = None, deadline: Deadline = None) -> tuple[str, list]:
+        # Every stage checks the request's deadline; if the LLM cannot finish within it the answer
+        # degrades to the retrieved passages and deadline.degraded is set.
+        deadline = deadline or Deadline()
+        # Identical questions arriving for the same session while one is already being answered
+        # share that answer instead of each firing its own Gemini call. History is not part of the key.
+        # The shared call runs under a deadline every waiter joins, so the first caller's client
+        # disconnecting doesn't cut the answer short for the others.
+        key = (conversation_id, normalize_question(query), k, json.dumps(filters, sort_keys=True))
+        response, retrieved_docs_data, degraded = self.single_flight.do(
+            key, lambda shared: self._answer_query(query, conversation_id, k, priority, filters, shared), deadline=deadline
+        )
+        deadline.degraded = degraded
+        return response, retrieved_docs_data
 
-    def get_response_from_query(self, query: str, conversation_id: str, k: int = 12) -> tuple[str, list]:
+    def _answer_query(self, query: str, conversation_id: str, k: int, priority: int, filters: dict, deadline: Deadline) -> tuple[str, list, bool]:
         
         chain = self.get_chain(conversation_id)
+        loaded = self.loaded # One snapshot for the whole query, even if a new session is swapped in meanwhile
+        if loaded is None:
+            raise ValueError("No session loaded.")
 
+        deadline.check("retrieval")
         # Encode the query using the same SentenceTransformer model
         query_embedding = self.embedding_model.encode([query]).astype("float32")
         
-        # Perform similarity search using FAISS
-        distances, indices = self.faiss_index.search(query_embedding, k)
+        # Perform similarity search using FAISS, restricted to chunks matching the filters if any
+        distances, indices = filtered_search(loaded.faiss_index, loaded.chunk_attributes, query_embedding, k, filters)
         
+        deadline.check("context build")
         # Retrieve the original text content from metadata
         retrieved_docs_data = []
         for i in indices[0]:
-            if i < len(self.metadata["chunks"]): # Safety check
-                retrieved_docs_data.append(self.metadata["chunks"][i])
+            if 0 <= i < len(loaded.metadata["chunks"]): # Safety check; FAISS pads with -1 when fewer than k chunks match
+                retrieved_docs_data.append(loaded.metadata["chunks"][i])
         
         # Combine the text previews of retrieved documents into a single string
         docs_page_content = " ".join([d["text_preview"] for d in retrieved_docs_data])
 
-        # Run the LLMChain with the combined context and the question
-        response = chain.run(question=query, docs=docs_page_content)
-        return response, retrieved_docs_data # Return the dicts from metadata
+        if deadline.remaining() < LLM_MIN_BUDGET_SECONDS:
+            return self._retrieval_only_answer(retrieved_docs_data), retrieved_docs_data, True
+
+        # Build the prompt (with history) once so a hedged duplicate call doesn't write memory twice
+        inputs = chain.prep_inputs({"question": query, "docs": docs_page_content})
+        prompt = chain.prompt.format_prompt(**{name: inputs[name] for name in chain.prompt.input_variables}).to_string()
+        try:
+            response = self.llm_scheduler.run_hedged(lambda: self.llm.invoke(prompt), priority, deadline)
+        except DeadlineExceeded:
+            return self._retrieval_only_answer(retrieved_docs_data), retrieved_docs_data, True
+        chain.memory.save_context({"question": query}, {chain.output_key: response})
+        return response, retrieved_docs_data, False # Return the dicts from metadata
+
+    def _retrieval_only_answer(self, retrieved_docs_data: list, max_passages: int = 3, max_chars: int = 400) -> str:
+        passages = [d["text_preview"][:max_chars].strip() for d in retrieved_docs_data[:max_passages]]
+        if not passages:
+            return "I’m not sure based on current information. Please ask to seniors"
+        return "I couldn't put together a full answer in time. These are the most relevant parts of the document:\n\n" + "\n\n".join(passages)
 
 if __name__ == "__main__":
 
@@ -1,12 +1,16 @@
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, send_file
 import os
 from RAGModel import LocalRAGSystemFAISS
-from supabase import create_client
+from session_storage import SessionStorage, SESSION_FILES, validate_session_id
+from extraction import extract_sources, unique_upload_names, TEXT_EXTENSIONS
+from supabase import create_client, ClientOptions
+from deadlines import Deadline, DeadlineExceeded
 from uuid import uuid4
 from dotenv import load_dotenv
 from flask_cors import CORS
 import fitz
 import shutil
+import threading
 
 
 def extract_text_from_pdf(pdf_path: str) -> str:
@@ -15,7 +19,8 @@ def extract_text_from_pdf(pdf_path: str) -> str:
     doc.close()
     return full_text
 
-rag_system = LocalRAGSystemFAISS(llm_model_name="gemini-2.5-flash")
+# Extraction pool workers re-run this script as __mp_main__ (see extraction.py); they don't need the model
+rag_system = LocalRAGSystemFAISS(llm_model_name="gemini-2.5-flash") if __name__ != "__mp_main__" else None
 
 app = Flask(__name__)
 load_dotenv()
@@ -29,14 +34,16 @@ SUPABASE_BUCKET = "documindai"
 if not SUPABASE_URL or not SUPABASE_KEY:
     raise EnvironmentError("Supabase credentials are missing")
 
-supabase = create_client(SUPABASE_URL, SUPABASE_KEY)
+# Storage calls (downloads in load_session included) give up instead of hanging a worker
+SUPABASE_TIMEOUT_SECONDS = int(os.getenv("SUPABASE_TIMEOUT_SECONDS", "20"))
+supabase = create_client(SUPABASE_URL, SUPABASE_KEY, options=ClientOptions(storage_client_timeout=SUPABASE_TIMEOUT_SECONDS))
 
-def upload_to_supabase(local_path, storage_path, content_type):
-    with open(local_path, "rb") as f:
-        supabase.storage.from_(SUPABASE_BUCKET).upload(storage_path, f, {
-            "content-type": content_type,
-            "x-upsert": "true"
-        })
+storage = SessionStorage(supabase, SUPABASE_BUCKET)
+
+# Each /load_session downloads into its own directory here; RagAPINew/tmp itself holds uploads in progress
+LOADED_SESSIONS_DIR = os.path.join("RagAPINew", "tmp", "sessions")
+loaded_session_dir = None # Directory of the session currently loaded into rag_system
+loaded_session_lock = threading.Lock()
 
 def save_and_upload_to_supabase(file_or_path, session_id, filename, content_type, is_file_object=False):
     # Sanitize filename
@@ -51,7 +58,8 @@ def save_and_upload_to_supabase(file_or_path, session_id, filename, content_type
         # file_or_path is a local path, copy to save_path
         import shutil
         shutil.copyfile(file_or_path, save_path)
-    upload_to_supabase(save_path, f"{session_id}/{safe_filename}", content_type)
+    # Original uploads are kept as-is; PDFs are already compressed
+    storage.upload(save_path, f"{session_id}/{safe_filename}", content_type, compress=False)
     return save_name, save_path
 
 def process_text_upload(text, session_id):
@@ -64,13 +72,13 @@ def process_text_upload(text, session_id):
         
     print("made common.txt")
     # Use the new function to save and upload
-    upload_to_supabase(local_txt_path, f"{session_id}/common.txt", "text/plain")
+    storage.upload(local_txt_path, f"{session_id}/common.txt", "text/plain")
     # save_and_upload_to_supabase(local_txt_path, session_id, "common.txt", "text/plain")
     print("uploaded file to supabase")
     # === 3. Generate FAISS + metadata ===
     index_path = os.path.join(tmp_dir, f"{session_id}_faiss.idx")
     meta_path = os.path.join(tmp_dir, f"{session_id}_meta.json")
-    rag_system.load_faiss_index_and_metadata(
+    dedup = rag_system.load_faiss_index_and_metadata(
         file_path=local_txt_path,
         faiss_index_path=index_path,
         meta_path=meta_path
@@ -78,55 +86,35 @@ def process_text_upload(text, session_id):
     
     print("given files to rag")
     # === 4. Upload FAISS index ===
-    upload_to_supabase(index_path, f"{session_id}/faiss.idx", "application/octet-stream")
+    storage.upload(index_path, f"{session_id}/faiss.idx", "application/octet-stream")
     # === 5. Upload Metadata ===
-    upload_to_supabase(meta_path, f"{session_id}/meta.json", "application/json")
+    storage.upload(meta_path, f"{session_id}/meta.json", "application/json")
+    storage.invalidate(session_id)
     return {
         "message": "Text uploaded and FAISS files created and uploaded",
-        "session_id": session_id
+        "session_id": session_id,
+        "dedup": dedup
     }
     
 @app.route('/session/<session_id>/document', methods=['GET'])
 def get_session_document(session_id):
     """
-    Returns document info and content for a session.
-    - If common.txt exists, returns as text document.
+    Returns document info for a session without its content or touching the FAISS index.
+    - If common.txt exists, returns it as a text document; its content is served
+      (with Range support) from content_url and as chunks from chunks_url.
     - If only PDF exists, returns as PDF (no preview content).
     """
     try:
-        # Try to download common.txt from Supabase
-        import tempfile
-        tmp_dir = tempfile.gettempdir()
-        local_txt_path = os.path.join(tmp_dir, f"{session_id}_common.txt")
-        remote_txt_path = f"{session_id}/common.txt"
         try:
-            # Download common.txt
-            res = supabase.storage.from_(SUPABASE_BUCKET).download(remote_txt_path)
-            with open(local_txt_path, "wb") as f:
-                f.write(res)
-            # Download faiss.idx and meta.json
-            faiss_path = os.path.join(tmp_dir, f"{session_id}_faiss.idx")
-            meta_path = os.path.join(tmp_dir, f"{session_id}_meta.json")
-            res_faiss = supabase.storage.from_(SUPABASE_BUCKET).download(f"{session_id}/faiss.idx")
-            with open(faiss_path, "wb") as f:
-                f.write(res_faiss)
-            res_meta = supabase.storage.from_(SUPABASE_BUCKET).download(f"{session_id}/meta.json")
-            with open(meta_path, "wb") as f:
-                f.write(res_meta)
-            # Load into RAG model
-            rag_system.load_faiss_index_and_metadata(
-                file_path=local_txt_path,
-                faiss_index_path=faiss_path,
-                meta_path=meta_path
-            )
-            with open(local_txt_path, "r", encoding="utf-8") as f:
-                content = f.read()
+            local_txt_path = storage.fetch_session_file(session_id, "common.txt")
             doc_info = {
                 "id": session_id,
                 "name": "common.txt",
                 "type": "text",
-                "size": len(content.encode("utf-8")),
-                "content": content
+                "size": os.path.getsize(local_txt_path),
+                "content": None,
+                "content_url": f"/session/{session_id}/document/content",
+                "chunks_url": f"/session/{session_id}/chunks"
             }
             return jsonify(doc_info)
         except Exception:
@@ -154,6 +142,36 @@ def get_session_document(session_id):
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+@app.route('/session/<session_id>/document/content', methods=['GET'])
+def get_session_document_content(session_id):
+    """Streams a session's common.txt; honours Range headers so clients can fetch it piece by piece."""
+    try:
+        local_txt_path = storage.fetch_session_file(session_id, "common.txt")
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception:
+        return jsonify({"error": "No text document found for this session."}), 404
+    return send_file(local_txt_path, mimetype="text/plain", conditional=True)
+
+@app.route('/session/<session_id>/chunks', methods=['GET'])
+def get_session_chunks(session_id):
+    """Pages through a session's indexed chunks (from meta.json) with ?offset=&limit=."""
+    offset = max(request.args.get("offset", 0, type=int), 0)
+    limit = min(max(request.args.get("limit", 50, type=int), 1), 200)
+    try:
+        chunks = storage.load_session_chunks(session_id)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        return jsonify({"error": str(e)}), 404
+    return jsonify({
+        "session_id": session_id,
+        "offset": offset,
+        "limit": limit,
+        "total": len(chunks),
+        "chunks": [{"id": offset + i, **chunk} for i, chunk in enumerate(chunks[offset:offset + limit])]
+    })
+
 # --- ✅ New Upload Text Endpoint ---
 @app.route("/upload-text", methods=["POST"])
 def upload_text():
@@ -162,6 +180,10 @@ def upload_text():
     session_id = data.get("session_id", str(uuid4()))  # Optional, generates if not given
     if not text:
         return jsonify({"error": "Missing 'text' in request body"}), 400
+    try:
+        validate_session_id(session_id)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
     try:
         resp = process_text_upload(text, session_id)
         return jsonify(resp)
@@ -193,6 +215,65 @@ def upload_pdf():
     except Exception as e:
         return jsonify({"error": str(e)}), 500
     
+def process_batch_upload(files, session_id):
+    """
+    Indexes many already-saved files into one session. Extraction is fanned out over a
+    process pool and every chunk keeps the file (and page) it came from.
+    """
+    tmp_dir = "RagAPINew/tmp"
+    texts, metadatas = extract_sources(files)
+    if not texts:
+        raise ValueError("No text could be extracted from the uploaded files")
+    print(f"extracted {len(texts)} texts from {len(files)} files")
+
+    # common.txt stays the session's combined document for preview and reloads
+    local_txt_path = os.path.join(tmp_dir, f"{session_id}_common.txt")
+    with open(local_txt_path, "w", encoding="utf-8") as f:
+        f.write("\n".join(texts))
+    storage.upload(local_txt_path, f"{session_id}/common.txt", "text/plain")
+
+    index_path = os.path.join(tmp_dir, f"{session_id}_faiss.idx")
+    meta_path = os.path.join(tmp_dir, f"{session_id}_meta.json")
+    dedup = rag_system.create_index_from_texts(texts, metadatas, faiss_index_path=index_path, meta_path=meta_path)
+
+    storage.upload(index_path, f"{session_id}/faiss.idx", "application/octet-stream")
+    storage.upload(meta_path, f"{session_id}/meta.json", "application/json")
+    storage.invalidate(session_id)
+    return {
+        "message": "Files uploaded and FAISS files created and uploaded",
+        "session_id": session_id,
+        "files": [name for name, _ in files],
+        "dedup": dedup
+    }
+
+@app.route('/upload-batch', methods=['POST'])
+def upload_batch():
+    uploads = request.files.getlist('files')
+    if not uploads:
+        return jsonify({"error": "No files part"}), 400
+    session_id = request.form.get("session_id", str(uuid4()))
+    try:
+        validate_session_id(session_id)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    for file in uploads:
+        name = (file.filename or '').lower()
+        if not name.endswith('.pdf') and not name.endswith(TEXT_EXTENSIONS):
+            return jsonify({"error": f"Unsupported file type: {file.filename}"}), 400
+
+    try:
+        files = []
+        names = unique_upload_names([file.filename for file in uploads])
+        for file, name in zip(uploads, names):
+            content_type = "application/pdf" if name.lower().endswith('.pdf') else "text/plain"
+            save_name, save_path = save_and_upload_to_supabase(file, session_id, name, content_type, is_file_object=True)
+            files.append((name, save_path))
+        resp = process_batch_upload(files, session_id)
+        return jsonify(resp)
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+    
 # --- Existing Query Endpoint ---
 @app.route("/query", methods=["POST"])
 def query():
@@ -203,12 +284,19 @@ def query():
 
     question = data["message"]
     conversation_id = data.get("conversation_id")  # optional
+    filters = data.get("filters")  # optional, e.g. {"source": "notes.pdf", "page": [10, 20]}
 
+    deadline = Deadline()
     try:
-        response, sources = rag_system.get_response_from_query(question, conversation_id)
+        response, sources = rag_system.get_response_from_query(question, conversation_id, filters=filters, deadline=deadline)
         return jsonify({
             "response": response,
+            "degraded": deadline.degraded  # True when the LLM ran out of time and only retrieved passages are returned
         })
+    except DeadlineExceeded as e:
+        return jsonify({"error": str(e)}), 504
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
@@ -227,6 +315,23 @@ def list_sessions():
         return jsonify({"error": str(e)}), 500
 
 
+def swap_loaded_session(session_dir):
+    """Loads a downloaded session into rag_system and drops the directory of the one it replaces."""
+    global loaded_session_dir
+    with loaded_session_lock:
+        try:
+            rag_system.load_faiss_index_and_metadata(
+                faiss_index_path=os.path.join(session_dir, "faiss.idx"),
+                meta_path=os.path.join(session_dir, "meta.json"),
+                file_path=os.path.join(session_dir, "common.txt")
+            )
+        except Exception:
+            shutil.rmtree(session_dir, ignore_errors=True)
+            raise
+        previous, loaded_session_dir = loaded_session_dir, session_dir
+    if previous:
+        shutil.rmtree(previous, ignore_errors=True)
+
 @app.route("/load_session", methods=["POST"])
 def load_session():
     data = request.get_json()
@@ -234,33 +339,18 @@ def load_session():
 
     if not session_id:
         return jsonify({"error": "Missing session_id"}), 400
-
     try:
-        file_names = ["common.txt", "faiss.idx", "meta.json"]
-        tmp_dir = os.path.join("RagAPINew", "tmp")
-        if os.path.exists(tmp_dir):
-            shutil.rmtree(tmp_dir)
-    
-        os.makedirs(tmp_dir, exist_ok=True)
-    
-        for file_name in file_names:
-            remote_path = f"{session_id}/{file_name}"
-            local_path = os.path.join(tmp_dir, file_name)
-
-            res = supabase.storage.from_(SUPABASE_BUCKET).download(remote_path)
-            with open(local_path, "wb") as f:
-                f.write(res)
-                
-        rag_system.load_faiss_index_and_metadata(
-                faiss_index_path="RagAPINew/tmp/faiss.idx",
-                meta_path="RagAPINew/tmp/meta.json",
-                file_path="RagAPINew/tmp/common.txt"
-            )
+        validate_session_id(session_id)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
 
+    try:
+        session_dir = storage.download_session(session_id, LOADED_SESSIONS_DIR)
+        swap_loaded_session(session_dir)
         return jsonify({
             "message": "Files downloaded successfully",
-            "saved_to": tmp_dir,
-            "files": file_names
+            "saved_to": session_dir,
+            "files": list(SESSION_FILES)
         })
 
     except Exception as e:
@@ -268,17 +358,24 @@ def load_session():
 
 @app.route("/get-common-txt", methods=["GET"])
 def get_common_txt():
-    # session_id is ignored for local path
-    txt_path = os.path.join("RagAPINew", "tmp", "common.txt")
-    if not os.path.exists(txt_path):
+    # common.txt of the currently loaded session
+    session_dir = loaded_session_dir
+    txt_path = os.path.abspath(os.path.join(session_dir, "common.txt")) if session_dir else None
+    if not txt_path or not os.path.exists(txt_path):
         return "common.txt not found", 404
     try:
-        with open(txt_path, "r", encoding="utf-8") as f:
-            content = f.read()
-        return content, 200, {"Content-Type": "text/plain; charset=utf-8"}
+        # Streamed from disk rather than read into memory; Range requests get 206 partial responses
+        return send_file(txt_path, mimetype="text/plain", conditional=True)
     except Exception as e:
         return str(e), 500
 
+@app.route("/llm-metrics", methods=["GET"])
+def llm_metrics():
+    return jsonify({
+        "scheduler": rag_system.llm_scheduler.metrics(),
+        "single_flight": rag_system.single_flight.stats()
+    })
+
 @app.route("/health", methods=["GET"])
 def health():
     return jsonify({"status": "ok"}), 200
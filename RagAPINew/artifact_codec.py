@@ -0,0 +1,89 @@
+import io
+import json
+import os
+import struct
+
+try:
+    import zstandard
+except ImportError:  # compression is optional; artifacts are then stored raw
+    zstandard = None
+
+# Compressed artifacts start with MAGIC, a 2-byte header length and a JSON header
+# such as {"codec": "zstd", "level": 3}. Anything without MAGIC is a raw artifact.
+MAGIC = b"DMAC"
+DEFAULT_CODEC = os.getenv("ARTIFACT_CODEC", "zstd" if zstandard else "none")
+DEFAULT_LEVEL = int(os.getenv("ARTIFACT_ZSTD_LEVEL", "3"))
+
+
+def _write_header(f, header: dict):
+    raw = json.dumps(header, separators=(",", ":")).encode("utf-8")
+    f.write(MAGIC + struct.pack(">H", len(raw)) + raw)
+
+
+def _read_header(f):
+    """Returns the header dict, or None (with the stream rewound) for a raw artifact."""
+    start = f.tell()
+    if f.read(len(MAGIC)) != MAGIC:
+        f.seek(start)
+        return None
+    (length,) = struct.unpack(">H", f.read(2))
+    return json.loads(f.read(length))
+
+
+def compress_file(src_path: str, dst_path: str, level: int = DEFAULT_LEVEL) -> dict:
+    """Stream-compresses src_path into dst_path with zstd and returns the header written."""
+    if zstandard is None:
+        raise RuntimeError("zstandard is not installed; cannot compress artifacts")
+    header = {"codec": "zstd", "level": level}
+    with open(src_path, "rb") as fin, open(dst_path, "wb") as fout:
+        _write_header(fout, header)
+        zstandard.ZstdCompressor(level=level).copy_stream(fin, fout, size=os.path.getsize(src_path))
+    return header
+
+
+def decode_to_file(data: bytes, dst_path: str):
+    """Writes a downloaded artifact to dst_path, decompressing it if it carries a codec header."""
+    src = io.BytesIO(data)
+    header = _read_header(src)
+    with open(dst_path, "wb") as fout:
+        if header is None or header["codec"] == "none":
+            fout.write(src.read())
+        elif header["codec"] == "zstd":
+            if zstandard is None:
+                raise RuntimeError("Artifact is zstd-compressed but zstandard is not installed")
+            zstandard.ZstdDecompressor().copy_stream(src, fout)
+        else:
+            raise ValueError(f"Unknown artifact codec: {header['codec']}")
+
+
+if __name__ == "__main__":
+    import glob
+    import sys
+    import tempfile
+    import time
+
+    # Benchmark: bytes transferred vs. CPU time per artifact type and zstd level.
+    # Usage: python artifact_codec.py [files...]  (defaults to the sample session in RagAPINew/tmp)
+    paths = sys.argv[1:] or sorted(
+        p for p in glob.glob(os.path.join(os.path.dirname(os.path.abspath(__file__)), "RagAPINew", "tmp", "*"))
+        if p.endswith(("_common.txt", "_faiss.idx", "_meta.json"))
+    )
+    link_mbit = 10  # "slow link" used for the transfer-time column
+    tmp_dir = tempfile.mkdtemp()
+    print(f"{'artifact':<12} {'level':>5} {'bytes':>10} {'ratio':>6} {'comp ms':>8} {'decomp ms':>9} {'xfer ms @' + str(link_mbit) + 'Mbit':>16}")
+    for path in paths:
+        name = path.rsplit("_", 1)[-1]
+        raw_size = os.path.getsize(path)
+        print(f"{name:<12} {'raw':>5} {raw_size:>10} {1.0:>6.2f} {0:>8.1f} {0:>9.1f} {raw_size * 8 / (link_mbit * 1000):>16.1f}")
+        for level in (1, 3, 9, 19):
+            dst = os.path.join(tmp_dir, f"{name}.{level}.zst")
+            start = time.process_time()
+            compress_file(path, dst, level)
+            comp_ms = (time.process_time() - start) * 1000
+            with open(dst, "rb") as f:
+                data = f.read()
+            start = time.process_time()
+            decode_to_file(data, dst + ".out")
+            decomp_ms = (time.process_time() - start) * 1000
+            size = len(data)
+            print(f"{'':<12} {level:>5} {size:>10} {raw_size / size:>6.2f} {comp_ms:>8.1f} {decomp_ms:>9.1f} {size * 8 / (link_mbit * 1000):>16.1f}")
@@ -0,0 +1,175 @@
+import re
+from datetime import date
+from typing import Optional
+
+import faiss
+import numpy as np
+
+# WhatsApp-style "12/06/24, 10:15 pm - ..." or "[12/06/2024, ..." line prefixes (day first)
+_DATE_RE = re.compile(r"(?:^|\n)\[?(\d{1,2})/(\d{1,2})/(\d{2,4}),")
+MISSING = -1
+
+
+def _date_range(text: str) -> tuple:
+    """Returns the earliest and latest transcript dates in the text as YYYYMMDD ints, or (MISSING, MISSING)."""
+    dates = []
+    for day, month, year in _DATE_RE.findall(text):
+        year = int(year) + 2000 if len(year) == 2 else int(year)
+        try:
+            dates.append(int(date(year, int(month), int(day)).strftime("%Y%m%d")))
+        except ValueError:
+            continue
+    return (min(dates), max(dates)) if dates else (MISSING, MISSING)
+
+
+def _parse_page(value) -> int:
+    if isinstance(value, bool) or not isinstance(value, int):
+        raise ValueError(f"'page' bounds must be integers, got {value!r}")
+    return value
+
+
+def _parse_date(value) -> int:
+    if not isinstance(value, str):
+        raise ValueError(f"'date' bounds must be YYYY-MM-DD strings, got {value!r}")
+    return int(date.fromisoformat(value).strftime("%Y%m%d"))
+
+
+class ChunkAttributes:
+    """
+    Column-per-attribute view of meta.json chunks. Dedup (see dedup.py) collapses repeats into
+    one chunk that lists every original position, so attributes are stored per occurrence:
+    one numpy row per position, with `chunk` mapping it back to its FAISS id. A filter is
+    evaluated per occurrence and a chunk matches if any of its occurrences does.
+    A chunk's date is the range of transcript dates it contains; date filters match on overlap.
+    Sources are dictionary-encoded so a source filter is a single integer comparison.
+    """
+
+    def __init__(self, chunks: list):
+        self.size = len(chunks)
+        occurrences = [
+            (chunk_id, position)
+            for chunk_id, chunk in enumerate(chunks)
+            for position in (chunk.get("positions") or [chunk])
+        ]
+        self.sources = sorted({p.get("source", "N/A") for _, p in occurrences})
+        codes = {name: i for i, name in enumerate(self.sources)}
+        dates = [_date_range(c["text_preview"]) for c in chunks]  # positions don't keep text; use the kept chunk's
+        count = len(occurrences)
+        self.chunk = np.fromiter((chunk_id for chunk_id, _ in occurrences), dtype=np.int32, count=count)
+        self.source = np.fromiter((codes[p.get("source", "N/A")] for _, p in occurrences), dtype=np.int32, count=count)
+        self.page = np.fromiter((p.get("page", MISSING) for _, p in occurrences), dtype=np.int32, count=count)
+        self.date_min = np.fromiter((dates[chunk_id][0] for chunk_id, _ in occurrences), dtype=np.int32, count=count)
+        self.date_max = np.fromiter((dates[chunk_id][1] for chunk_id, _ in occurrences), dtype=np.int32, count=count)
+        self._source_bitmaps = {}
+
+    def _source_mask(self, name: str) -> np.ndarray:
+        # Per-source bitmaps are cached: sessions have few sources and they are queried repeatedly
+        if name not in self._source_bitmaps:
+            code = self.sources.index(name) if name in self.sources else MISSING
+            self._source_bitmaps[name] = self.source == code
+        return self._source_bitmaps[name]
+
+    def mask(self, filters: dict) -> np.ndarray:
+        """
+        Evaluates a filter expression into a boolean mask over chunk ids. Supported keys,
+        all ANDed together within one occurrence:
+          "source": a name or list of names
+          "page":   [first, last] inclusive
+          "date":   ["YYYY-MM-DD", "YYYY-MM-DD"] inclusive, matching chunks whose dates overlap it
+        Either end of a range may be null. Malformed filters raise ValueError.
+        """
+        if not isinstance(filters, dict):
+            raise ValueError("filters must be an object")
+        unknown = set(filters) - {"source", "page", "date"}
+        if unknown:
+            raise ValueError(f"Unsupported filter keys: {sorted(unknown)}")
+
+        matches = np.ones(len(self.chunk), dtype=bool)
+        if "source" in filters:
+            names = filters["source"]
+            names = [names] if isinstance(names, str) else names
+            if not isinstance(names, list) or not all(isinstance(name, str) for name in names):
+                raise ValueError("'source' filter must be a name or a list of names")
+            source_mask = np.zeros(len(self.chunk), dtype=bool)
+            for name in names:
+                source_mask |= self._source_mask(name)
+            matches &= source_mask
+        # An occurrence's [first, last] span overlaps the requested range; pages span a single value
+        for key, first, last, parse in (
+            ("page", self.page, self.page, _parse_page),
+            ("date", self.date_min, self.date_max, _parse_date),
+        ):
+            if key not in filters:
+                continue
+            bounds = filters[key]
+            if not isinstance(bounds, (list, tuple)) or len(bounds) != 2:
+                raise ValueError(f"'{key}' filter must be a [first, last] pair")
+            low, high = bounds
+            matches &= first != MISSING
+            if low is not None:
+                matches &= last >= parse(low)
+            if high is not None:
+                matches &= first <= parse(high)
+
+        mask = np.zeros(self.size, dtype=bool)
+        mask[self.chunk[matches]] = True
+        return mask
+
+
+class FilteredSearch:
+    """Keeps the packed bitmap alive for as long as FAISS may read it."""
+
+    def __init__(self, mask: np.ndarray):
+        self.count = int(mask.sum())
+        self._bits = np.packbits(mask, bitorder="little")
+        # IDSelectorBitmap takes the bitmap size in bytes, not ids
+        self.params = faiss.SearchParameters(sel=faiss.IDSelectorBitmap(len(self._bits), faiss.swig_ptr(self._bits)))
+
+
+def filtered_search(index, attributes: ChunkAttributes, query_embedding, k: int, filters: Optional[dict] = None):
+    """FAISS search restricted to chunks matching `filters`; skips the selector entirely when there are none."""
+    if not filters:
+        return index.search(query_embedding, k)
+    search = FilteredSearch(attributes.mask(filters))
+    if search.count == 0:
+        return np.full((1, k), np.inf, dtype="float32"), np.full((1, k), -1, dtype="int64")
+    return index.search(query_embedding, k, params=search.params)
+
+
+if __name__ == "__main__":
+    import time
+
+    # Benchmark: filtered search vs. unfiltered vs. over-fetch-and-filter in Python
+    n, dim, k, queries = 50_000, 384, 12, 50
+    rng = np.random.default_rng(0)
+    vectors = rng.random((n, dim), dtype=np.float32)
+    index = faiss.IndexFlatL2(dim)
+    index.add(vectors)
+    chunks = [{"text_preview": "", "source": f"file_{i % 100}.pdf", "page": i % 500} for i in range(n)]
+    attributes = ChunkAttributes(chunks)
+    qs = rng.random((queries, dim), dtype=np.float32)
+
+    def timed(fn):
+        start = time.perf_counter()
+        for q in qs:
+            fn(q[None, :])
+        return (time.perf_counter() - start) / queries * 1000
+
+    base = timed(lambda q: index.search(q, k))
+    print(f"unfiltered: {base:.2f} ms/query")
+    for label, filters in (
+        ("50%", {"page": [0, 249]}),
+        ("10%", {"source": [f"file_{i}.pdf" for i in range(10)]}),
+        ("1%", {"source": "file_7.pdf"}),
+        ("0.2%", {"source": "file_7.pdf", "page": [0, 99]}),
+    ):
+        mask = attributes.mask(filters)
+        selected = timed(lambda q: filtered_search(index, attributes, q, k, filters))
+
+        def overfetch(q, mask=mask):
+            # What we would otherwise do: fetch enough to likely cover k matches, then filter
+            fetch = min(n, int(k / max(mask.mean(), 1e-6) * 2))
+            _, ids = index.search(q, fetch)
+            return [i for i in ids[0] if mask[i]][:k]
+
+        print(f"selectivity {label:>5} ({int(mask.sum())} chunks): IDSelector {selected:.2f} ms/query, over-fetch {timed(overfetch):.2f} ms/query")
@@ -0,0 +1,99 @@
+import os
+import threading
+import time
+from concurrent.futures import Future
+from typing import Callable
+
+# Default end-to-end budget for one /query, and how much of it the LLM stage needs at minimum;
+# with less than that left, the answer degrades to retrieval-only instead of calling Gemini.
+QUERY_DEADLINE_SECONDS = float(os.getenv("QUERY_DEADLINE_SECONDS", "30"))
+LLM_MIN_BUDGET_SECONDS = float(os.getenv("LLM_MIN_BUDGET_SECONDS", "1.0"))
+
+
+class DeadlineExceeded(TimeoutError):
+    pass
+
+
+class Deadline:
+    """
+    Per-request time budget carried through every stage of the query path.
+    Stages call check() between steps; cancel() makes every later check fail. The FastAPI
+    /query cancels when its client disconnects; Flask has no such hook, so there the
+    deadline is the only bound.
+    `degraded` is set when the answer had to fall back to retrieval-only.
+    """
+
+    def __init__(self, timeout: float = QUERY_DEADLINE_SECONDS):
+        self.expires_at = time.monotonic() + timeout
+        self.degraded = False
+        self._cancelled = threading.Event()
+        self._lock = threading.Lock()
+        self._on_cancel = []
+
+    def remaining(self) -> float:
+        return 0.0 if self._cancelled.is_set() else max(0.0, self.expires_at - time.monotonic())
+
+    def expired(self) -> bool:
+        return self.remaining() <= 0
+
+    def cancel(self):
+        with self._lock:
+            if self._cancelled.is_set():
+                return
+            self._cancelled.set()
+            callbacks, self._on_cancel = self._on_cancel, []
+        for fn in callbacks:
+            fn()
+
+    def on_cancel(self, fn):
+        """Calls fn once when the deadline is cancelled (right away if it already is), on the cancelling thread."""
+        with self._lock:
+            if not self._cancelled.is_set():
+                self._on_cancel.append(fn)
+                return
+        fn()
+
+    def cancelled_future(self) -> Future:
+        """A future that completes on cancel(), so blocking waits can watch it alongside their own futures."""
+        future = Future()
+        self.on_cancel(lambda: future.set_result(None))
+        return future
+
+    def check(self, stage: str):
+        if self._cancelled.is_set():
+            raise DeadlineExceeded(f"Request cancelled before {stage}")
+        if self.expired():
+            raise DeadlineExceeded(f"Deadline exceeded before {stage}")
+
+
+class SharedDeadline(Deadline):
+    """
+    Deadline for one piece of work several requests wait on (see SingleFlight). It lasts until
+    the latest waiter's deadline and is cancelled only once every waiter has gone, so one client
+    disconnecting doesn't cut the answer short for the others.
+    """
+
+    def __init__(self):
+        super().__init__(0)
+        self.expires_at = float("-inf")
+        self._waiters = 0
+
+    def join(self, deadline: Deadline) -> Callable[[], None]:
+        """Adds a waiter and returns the function that removes it; cancelling `deadline` removes it too."""
+        with self._lock:
+            self._waiters += 1
+            self.expires_at = max(self.expires_at, deadline.expires_at)
+        left = []
+
+        def leave():
+            with self._lock:
+                if left:
+                    return
+                left.append(True)
+                self._waiters -= 1
+                last = self._waiters == 0
+            if last:
+                self.cancel()
+
+        deadline.on_cancel(leave)
+        return leave
@@ -0,0 +1,88 @@
+import hashlib
+import re
+from typing import Dict, List
+
+SIMHASH_BITS = 64
+# 64 bits split into 4 bands of 16: two hashes within 3 bits of each other must agree
+# exactly on at least one band, so band buckets find every candidate pair.
+SIMHASH_BANDS = 4
+DEFAULT_MAX_DISTANCE = 3
+
+
+def _shingles(text: str, size: int = 3) -> List[str]:
+    words = re.findall(r"\w+", text.lower())
+    if len(words) < size:
+        return [" ".join(words)]
+    return [" ".join(words[i:i + size]) for i in range(len(words) - size + 1)]
+
+
+def simhash(text: str) -> int:
+    """64-bit SimHash over word 3-shingles."""
+    weights = [0] * SIMHASH_BITS
+    for shingle in _shingles(text):
+        h = int.from_bytes(hashlib.blake2b(shingle.encode("utf-8"), digest_size=8).digest(), "big")
+        for bit in range(SIMHASH_BITS):
+            weights[bit] += 1 if (h >> bit) & 1 else -1
+    return sum(1 << bit for bit in range(SIMHASH_BITS) if weights[bit] > 0)
+
+
+def _bands(h: int):
+    width = SIMHASH_BITS // SIMHASH_BANDS
+    mask = (1 << width) - 1
+    return [(band, (h >> (band * width)) & mask) for band in range(SIMHASH_BANDS)]
+
+
+def find_near_duplicates(texts: List[str], max_distance: int = DEFAULT_MAX_DISTANCE) -> List[int]:
+    """
+    Returns, for every text, the index of the text it collapses into: itself if it is
+    the first of its kind, otherwise the earliest kept text within `max_distance` bits.
+    """
+    buckets: Dict[tuple, List[int]] = {}
+    hashes: List[int] = []
+    representative: List[int] = []
+
+    for i, text in enumerate(texts):
+        h = simhash(text)
+        hashes.append(h)
+        match = None
+        for band in _bands(h):
+            for j in buckets.get(band, ()):
+                if bin(h ^ hashes[j]).count("1") <= max_distance:
+                    match = j
+                    break
+            if match is not None:
+                break
+
+        if match is None:
+            representative.append(i)
+            for band in _bands(h):
+                buckets.setdefault(band, []).append(i)
+        else:
+            representative.append(match)
+    return representative
+
+
+def dedup_chunks(docs, max_distance: int = DEFAULT_MAX_DISTANCE):
+    """
+    Collapses near-duplicate split documents. Returns the kept documents, the original
+    positions each one stands for, and a summary of how much was removed.
+    """
+    representative = find_near_duplicates([doc.page_content for doc in docs], max_distance)
+
+    kept = []
+    positions: Dict[int, List[dict]] = {}
+    for i, (doc, rep) in enumerate(zip(docs, representative)):
+        if rep == i:
+            kept.append(doc)
+            positions[i] = []
+        # Keep whatever locates the chunk: source, start_index and, for batch uploads, page
+        positions[rep].append({"chunk": i, "source": "N/A", **doc.metadata})
+
+    total = len(docs)
+    stats = {
+        "total_chunks": total,
+        "unique_chunks": len(kept),
+        "removed_chunks": total - len(kept),
+        "dedup_ratio": round((total - len(kept)) / total, 4) if total else 0.0,
+    }
+    return kept, [positions[i] for i, rep in enumerate(representative) if rep == i], stats
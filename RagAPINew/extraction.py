@@ -0,0 +1,103 @@
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import List, Tuple
+
+import fitz
+
+PAGES_PER_TASK = 16
+TEXT_EXTENSIONS = (".txt", ".md", ".csv", ".log")
+
+
+# One pool per server process, created on first use. Workers come from a forkserver rather
+# than a fork of the server itself: the server is multithreaded (request threads, LLM
+# scheduler workers, torch) and forking it can deadlock on locks held by other threads.
+# Like spawn, forkserver workers re-run the server script as __mp_main__, so the servers
+# skip loading the RAG model under that name.
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool() -> ProcessPoolExecutor:
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            ctx = multiprocessing.get_context("forkserver")
+            ctx.set_forkserver_preload(["extraction"])  # workers start with fitz already imported
+            _pool = ProcessPoolExecutor(max_workers=os.cpu_count(), mp_context=ctx)
+        return _pool
+
+
+def _reset_pool():
+    global _pool
+    with _pool_lock:
+        _pool = None
+
+
+def unique_upload_names(filenames: List[str]) -> List[str]:
+    """
+    Makes batch file names unique so two uploads with the same name don't overwrite each
+    other on disk or in storage: repeats get their batch index as a prefix ("3_notes.pdf").
+    """
+    seen = set()
+    names = []
+    for i, name in enumerate(filenames):
+        while name in seen:
+            name = f"{i}_{name}"
+        seen.add(name)
+        names.append(name)
+    return names
+
+
+def pdf_page_count(pdf_path: str) -> int:
+    with fitz.open(pdf_path) as doc:
+        return doc.page_count
+
+
+def extract_pdf_page_range(pdf_path: str, start: int, end: int) -> List[Tuple[int, str]]:
+    """Returns (1-based page number, text) for pages [start, end) of a PDF."""
+    with fitz.open(pdf_path) as doc:
+        return [(page_no + 1, doc[page_no].get_text()) for page_no in range(start, end)]
+
+
+def read_text_file(path: str) -> str:
+    with open(path, "r", encoding="utf-8", errors="replace") as f:
+        return f.read()
+
+
+def extract_sources(files: List[Tuple[str, str]]) -> Tuple[List[str], List[dict]]:
+    """
+    Extracts text from many (display name, local path) files in parallel, splitting
+    PDFs into page ranges so one large book is spread across every worker.
+    Returns texts and matching metadata in file and page order.
+    """
+    pool = get_pool()
+    try:
+        jobs = []
+        for name, path in files:
+            if path.lower().endswith(".pdf"):
+                pages = pdf_page_count(path)
+                for start in range(0, pages, PAGES_PER_TASK):
+                    jobs.append((name, "pdf", pool.submit(extract_pdf_page_range, path, start, min(start + PAGES_PER_TASK, pages))))
+            else:
+                jobs.append((name, "text", pool.submit(read_text_file, path)))
+
+        texts, metadatas = [], []
+        for name, kind, future in jobs:
+            if kind == "pdf":
+                for page_no, text in future.result():
+                    if text.strip():
+                        texts.append(text)
+                        metadatas.append({"source": name, "page": page_no})
+            else:
+                text = future.result()
+                if text.strip():
+                    texts.append(text)
+                    metadatas.append({"source": name})
+    except BrokenProcessPool:
+        # A crashed worker poisons the pool; start a fresh one for the next batch
+        _reset_pool()
+        raise
+    return texts, metadatas
@@ -1,21 +1,42 @@
 import uvicorn
+import asyncio
 import os
 import shutil
+import threading
+from contextlib import asynccontextmanager
 from dotenv import load_dotenv
 from uuid import uuid4
 from typing import Optional, Dict, List
 
-from fastapi import FastAPI, HTTPException, status, BackgroundTasks, UploadFile, File, Form
+from fastapi import FastAPI, HTTPException, status, BackgroundTasks, UploadFile, File, Form, Request
+from fastapi.concurrency import run_in_threadpool
 from pydantic import BaseModel, Field # Import Field for Pydantic models
-from fastapi.responses import PlainTextResponse
+from fastapi.responses import FileResponse
 # Import CORSMiddleware
 from fastapi.middleware.cors import CORSMiddleware
 
 # Supabase client library
-from supabase import create_client, Client
+from supabase import create_client, Client, ClientOptions
+
+from RAGModel import LocalRAGSystemFAISS
+from deadlines import Deadline, DeadlineExceeded
+from session_storage import SessionStorage, SESSION_FILES, validate_session_id
+from extraction import extract_sources, unique_upload_names, TEXT_EXTENSIONS
+from stall_detector import EventLoopStallDetector
 
 load_dotenv()
 
+# Everything below that talks to Supabase, the filesystem, FAISS or the LLM is synchronous.
+# Endpoints stay async but hand that work to the threadpool (run_in_threadpool), and
+# background tasks are plain functions, which Starlette also runs in the threadpool.
+
+# --- Debug: event loop stall detection ---
+DEBUG_EVENT_LOOP = os.getenv("DEBUG_EVENT_LOOP", "").lower() in ("1", "true", "yes")
+LOOP_STALL_THRESHOLD_MS = float(os.getenv("LOOP_STALL_THRESHOLD_MS", "100"))
+
+# How often /query checks whether its client has gone away
+DISCONNECT_POLL_SECONDS = float(os.getenv("DISCONNECT_POLL_SECONDS", "0.5"))
+
 # --- Supabase Config ---
 SUPABASE_URL: str = os.getenv("SUPABASE_URL")
 SUPABASE_KEY: str = os.getenv("SUPABASE_KEY")
@@ -26,7 +47,11 @@ if not SUPABASE_URL or not SUPABASE_KEY:
     print("EnvironmentError: Supabase credentials (SUPABASE_URL, SUPABASE_KEY) are missing. Supabase operations will be skipped.")
 else:
     try:
-        supabase = create_client(SUPABASE_URL, SUPABASE_KEY)
+        # Storage calls give up after SUPABASE_TIMEOUT_SECONDS instead of hanging a threadpool worker
+        supabase = create_client(
+            SUPABASE_URL, SUPABASE_KEY,
+            options=ClientOptions(storage_client_timeout=int(os.getenv("SUPABASE_TIMEOUT_SECONDS", "20")))
+        )
         # Optional: Test connection, though list() will do that anyway
         print("Supabase client initialized successfully.")
     except Exception as e:
@@ -35,12 +60,23 @@ else:
 
 
 # --- FastAPI App Initialization ---
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    detector = None
+    if DEBUG_EVENT_LOOP:
+        detector = EventLoopStallDetector(threshold=LOOP_STALL_THRESHOLD_MS / 1000)
+        detector.start()
+    yield
+    if detector:
+        detector.stop()
+
 app = FastAPI(
     title="DocuMind AI Backend",
     description="FastAPI server for document processing and RAG integration.",
-    version="0.1.0",
+    version="0.2.0",
     docs_url="/documentation",
     redoc_url="/redoc",
+    lifespan=lifespan,
 )
 
 # --- CORS Configuration ---
@@ -61,59 +97,47 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# --- Placeholder for RAG System ---
-class MockRAGSystem:
-    def load_faiss_index_and_metadata(self, file_path: str, faiss_index_path: str, meta_path: str):
-        print(f"MockRAGSystem: Processing {file_path} to create FAISS index at {faiss_index_path} and metadata at {meta_path}")
-        with open(faiss_index_path, "w") as f:
-            f.write("dummy faiss index content")
-        with open(meta_path, "w") as f:
-            f.write('{"status": "mocked_metadata"}')
-        print("MockRAGSystem: FAISS index and metadata generated.")
-
-rag_system = MockRAGSystem()
+# --- RAG System ---
+# Extraction pool workers re-run this script as __mp_main__ (see extraction.py); they don't need the model
+rag_system = LocalRAGSystemFAISS(llm_model_name="gemini-2.5-flash") if __name__ != "__mp_main__" else None
 
+TMP_DIR = os.path.join("tmp")
+# Each session load downloads into its own directory here; TMP_DIR itself holds uploads in progress
+LOADED_SESSIONS_DIR = os.path.join(TMP_DIR, "sessions")
+loaded_session_dir: Optional[str] = None # Directory of the session currently loaded into rag_system
+loaded_session_lock = threading.Lock()
 # --- Supabase Helper Functions ---
+storage = SessionStorage(supabase, SUPABASE_BUCKET, raise_upload_errors=False) # Shared with the Flask server
 
-def upload_to_supabase(local_path: str, storage_path: str, content_type: str):
-    """Uploads a local file to Supabase storage."""
-    if not supabase:
-        print(f"Skipping upload to Supabase: Supabase client not initialized. File: {local_path}")
-        return
-
+def require_session_id(session_id: str) -> str:
+    """validate_session_id for client-supplied ids, reported as a 400."""
     try:
-        with open(local_path, "rb") as f:
-            supabase.storage.from_(SUPABASE_BUCKET).upload(storage_path, f, {
-                "content-type": content_type,
-                "x-upsert": "true"
-            })
-        print(f"Successfully uploaded {local_path} to Supabase at {storage_path}")
-    except Exception as e:
-        print(f"Error uploading {local_path} to Supabase: {e}")
-        # In a real app, you might want to log this error more robustly
-        # and potentially re-raise if it's critical.
+        return validate_session_id(session_id)
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
 
-async def save_and_upload_to_supabase(
-    file_object: UploadFile, session_id: str, content_type: str
+def save_and_upload_to_supabase(
+    file_object: UploadFile, session_id: str, content_type: str, filename: Optional[str] = None
 ) -> tuple[str, str]:
     """
-    Saves an uploaded file locally and then uploads it to Supabase.
-    Returns the saved filename and its local path.
+    Saves an uploaded file locally (as `filename` if given) and then uploads it to Supabase.
+    Returns the saved filename and its local path. Blocking; call it from the threadpool.
     """
-    safe_filename = file_object.filename.replace(' ', '_') if file_object.filename else "unknown_file"
+    filename = filename or file_object.filename
+    safe_filename = filename.replace(' ', '_') if filename else "unknown_file"
     
-    tmp_dir = os.path.join('tmp')
-    os.makedirs(tmp_dir, exist_ok=True)
+    os.makedirs(TMP_DIR, exist_ok=True)
     
     save_name = f"{session_id}_{safe_filename}"
-    save_path = os.path.join(tmp_dir, save_name)
+    save_path = os.path.join(TMP_DIR, save_name)
 
     try:
         with open(save_path, "wb") as buffer:
             shutil.copyfileobj(file_object.file, buffer)
         print(f"Saved uploaded file locally to {save_path}")
 
-        upload_to_supabase(save_path, f"{session_id}/{safe_filename}", content_type)
+        # Original uploads are kept as-is; PDFs are already compressed
+        storage.upload(save_path, f"{session_id}/{safe_filename}", content_type, compress=False)
         
         return save_name, save_path
     except Exception as e:
@@ -122,42 +146,33 @@ async def save_and_upload_to_supabase(
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"Failed to process file: {e}")
 
 
-# --- Background Task Processor ---
-async def process_text_upload_task(text: str, session_id: str):
+# --- Session Processing (blocking; run from the threadpool) ---
+def process_texts(texts: List[str], metadatas: List[dict], session_id: str) -> dict:
     """
-    Performs the heavy lifting of text processing, FAISS generation,
-    and Supabase uploads in a background task.
+    Writes the session's common.txt, builds the FAISS index and metadata over the given
+    texts (one per file or page) and uploads all three artifacts to Supabase.
     """
-    tmp_dir = os.path.join('tmp')
-    os.makedirs(tmp_dir, exist_ok=True)
+    os.makedirs(TMP_DIR, exist_ok=True)
 
-    local_txt_path = os.path.join(tmp_dir, f"{session_id}_common.txt")
+    local_txt_path = os.path.join(TMP_DIR, f"{session_id}_common.txt")
+    index_path = os.path.join(TMP_DIR, f"{session_id}_faiss.idx")
+    meta_path = os.path.join(TMP_DIR, f"{session_id}_meta.json")
     
     try:
         with open(local_txt_path, "w", encoding="utf-8") as f:
-            f.write(text)
+            f.write("\n".join(texts))
         print(f"Saved text locally to {local_txt_path}")
         
-        upload_to_supabase(local_txt_path, f"{session_id}/common.txt", "text/plain")
+        storage.upload(local_txt_path, f"{session_id}/common.txt", "text/plain")
         
-        index_path = os.path.join(tmp_dir, f"{session_id}_faiss.idx")
-        meta_path = os.path.join(tmp_dir, f"{session_id}_meta.json")
-        
-        rag_system.load_faiss_index_and_metadata(
-            file_path=local_txt_path,
-            faiss_index_path=index_path,
-            meta_path=meta_path
-        )
+        dedup = rag_system.create_index_from_texts(texts, metadatas, faiss_index_path=index_path, meta_path=meta_path)
         print("FAISS index and metadata generated by RAG system.")
         
-        upload_to_supabase(index_path, f"{session_id}/faiss.idx", "application/octet-stream")
+        storage.upload(index_path, f"{session_id}/faiss.idx", "application/octet-stream")
         
-        upload_to_supabase(meta_path, f"{session_id}/meta.json", "application/json")
-
-        print(f"Background task completed for session_id: {session_id}")
-
-    except Exception as e:
-        print(f"Error during background processing for session_id {session_id}: {e}")
+        storage.upload(meta_path, f"{session_id}/meta.json", "application/json")
+        storage.invalidate(session_id)
+        return {"session_id": session_id, "dedup": dedup}
     finally:
         for path in [local_txt_path, index_path, meta_path]:
             if os.path.exists(path):
@@ -167,53 +182,68 @@ async def process_text_upload_task(text: str, session_id: str):
                 except OSError as e:
                     print(f"Error cleaning up file {path}: {e}")
 
-async def load_session_task(session_id: str):
+def process_files(files: List[tuple], session_id: str) -> dict:
+    """Extracts (name, local path) files in parallel (see extraction) and indexes them into one session."""
+    texts, metadatas = extract_sources(files)
+    if not texts:
+        raise ValueError("No text could be extracted from the uploaded files")
+    return process_texts(texts, metadatas, session_id)
+
+def process_text_upload_task(text: str, session_id: str):
     """
-    Background task to download session files from Supabase,
-    clean the local tmp directory, and load the RAG system.
+    Background task for /upload-text. Defined as a plain function so Starlette
+    runs it in the threadpool rather than on the event loop.
     """
-    file_names = ["common.txt", "faiss.idx", "meta.json"]
-    tmp_dir = os.path.join("tmp") # Standardizing tmp_dir path
-    
     try:
-        # Clean up existing tmp directory before downloading new session files
-        if os.path.exists(tmp_dir):
-            print(f"Removing existing tmp directory: {tmp_dir}")
-            shutil.rmtree(tmp_dir)
-        os.makedirs(tmp_dir, exist_ok=True)
-        print(f"Created fresh tmp directory: {tmp_dir}")
-
-        if not supabase:
-            raise RuntimeError("Supabase client not initialized. Cannot load session files.")
-
-        for file_name in file_names:
-            remote_path = f"{session_id}/{file_name}"
-            local_path = os.path.join(tmp_dir, file_name)
-
-            print(f"Attempting to download {remote_path} to {local_path}")
-            res = supabase.storage.from_(SUPABASE_BUCKET).download(remote_path)
-            with open(local_path, "wb") as f:
-                f.write(res)
-            print(f"Successfully downloaded {file_name}")
-            
-        # Load the RAG system with the newly downloaded files
-        rag_system.load_faiss_index_and_metadata(
-            file_path=os.path.join(tmp_dir, "common.txt"),
-            faiss_index_path=os.path.join(tmp_dir, "faiss.idx"),
-            meta_path=os.path.join(tmp_dir, "meta.json")
-        )
-        print(f"RAG system loaded for session: {session_id}")
+        process_texts([text], [{"source": "common.txt"}], session_id)
+        print(f"Background task completed for session_id: {session_id}")
+    except Exception as e:
+        print(f"Error during background processing for session_id {session_id}: {e}")
 
+def find_session_pdf(session_id: str) -> Optional[dict]:
+    """Returns the name and size of the first PDF in a session's storage folder, or None. Blocking."""
+    if not supabase:
+        return None
+    for item in supabase.storage.from_(SUPABASE_BUCKET).list(session_id):
+        if item['name'].lower().endswith('.pdf'):
+            meta = supabase.storage.from_(SUPABASE_BUCKET).get_metadata(f"{session_id}/{item['name']}")
+            return {"name": item['name'], "size": meta.get('size', 0)}
+    return None
+
+def load_session(session_id: str) -> str:
+    """
+    Downloads session files from Supabase into a directory of their own, loads them into
+    the RAG system and returns that directory. The previously loaded session's directory
+    is removed; uploads in progress under TMP_DIR are left alone.
+    """
+    global loaded_session_dir
+    session_dir = storage.download_session(session_id, LOADED_SESSIONS_DIR)
+    print(f"Downloaded session {session_id} to {session_dir}")
+
+    with loaded_session_lock:
+        try:
+            rag_system.load_faiss_index_and_metadata(
+                file_path=os.path.join(session_dir, "common.txt"),
+                faiss_index_path=os.path.join(session_dir, "faiss.idx"),
+                meta_path=os.path.join(session_dir, "meta.json")
+            )
+        except Exception:
+            shutil.rmtree(session_dir, ignore_errors=True)
+            raise
+        previous, loaded_session_dir = loaded_session_dir, session_dir
+    if previous:
+        shutil.rmtree(previous, ignore_errors=True)
+    print(f"RAG system loaded for session: {session_id}")
+    return session_dir
+
+def load_session_task(session_id: str):
+    """Background task wrapper around load_session; runs in the threadpool."""
+    try:
+        load_session(session_id)
     except Exception as e:
         print(f"Error during background loading of session {session_id}: {e}")
         # In a real app, you might want to log this error more robustly
         # and potentially update a status in a database.
-    finally:
-        # Optional: Clean up downloaded files after RAG system is loaded
-        # For a RAG system that keeps files in memory, you might delete them.
-        # If the RAG system needs the files on disk, you might skip this cleanup.
-        # For now, let's keep them as the original Flask code implies they stay.
-        pass
     
 # --- Pydantic Models for Request/Response Bodies ---
 class UploadTextRequest(BaseModel):
@@ -231,6 +261,15 @@ class LoadSessionResponse(BaseModel):
     session_id: str
     status: str = Field(..., example="processing_in_background")
 
+class QueryRequest(BaseModel):
+    message: str
+    conversation_id: Optional[str] = None
+    filters: Optional[Dict] = Field(None, example={"source": "notes.pdf", "page": [10, 20]})
+
+class QueryResponse(BaseModel):
+    response: str
+    degraded: bool = False # True when the LLM ran out of time and only retrieved passages are returned
+
 
 # --- FastAPI Endpoints ---
 
@@ -256,7 +295,7 @@ async def upload_text_endpoint(
     The heavy processing is offloaded to a background task.
     """
     text = request_data.text
-    session_id = request_data.session_id if request_data.session_id else str(uuid4())
+    session_id = require_session_id(request_data.session_id) if request_data.session_id else str(uuid4())
     if not text:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
@@ -286,9 +325,8 @@ async def list_sessions():
         # If your Supabase bucket is structured with 'session_id/file.txt',
         # listing with no prefix will give you the top-level 'session_id' directories.
         
-        # Note: The list method in supabase-py is synchronous. If it were async,
-        # you'd use await supabase.storage.from_(...).list(...)
-        result = supabase.storage.from_(SUPABASE_BUCKET).list("", {"limit": 1000})
+        # The list method in supabase-py is synchronous, so it runs in the threadpool
+        result = await run_in_threadpool(supabase.storage.from_(SUPABASE_BUCKET).list, "", {"limit": 1000})
  
         sessions = [item['name'] for item in result]
 
@@ -297,34 +335,200 @@ async def list_sessions():
         print(f"Error listing sessions from Supabase: {e}")
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"Failed to list sessions: {e}")
 
-@app.get("/get-common-txt", response_class=PlainTextResponse)
+@app.get("/get-common-txt", response_class=FileResponse)
 async def get_common_txt_endpoint():
     """
-    Retrieves the content of the locally stored 'common.txt' file.
+    Streams the 'common.txt' of the currently loaded session from disk.
+    Range requests are answered with 206 partial content.
     """
-    # The original Flask code used "RagAPINew/tmp/common.txt".
-    # Ensure this path is correct relative to where your FastAPI app is run.
-    # If `tmp` is at the root of your project, it should be 'tmp/common.txt'.
-    # I'm assuming 'RagAPINew' is a parent directory. Adjust if needed.
-    txt_path = os.path.join("RagAPINew", "tmp", "common.txt")
-    
-    if not os.path.exists(txt_path):
+    session_dir = loaded_session_dir
+    txt_path = os.path.join(session_dir, "common.txt") if session_dir else None
+
+    if not txt_path or not os.path.exists(txt_path):
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="common.txt not found at specified path."
         )
+    return FileResponse(txt_path, media_type="text/plain; charset=utf-8")
+
+
+@app.post("/upload-pdf")
+async def upload_pdf_endpoint(file: UploadFile = File(...)):
+    """
+    Receives a single PDF, stores it and indexes it into a new session.
+    """
+    if not file.filename or not file.filename.lower().endswith('.pdf'):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Only PDF files are allowed")
+    session_id = str(uuid4())
+    save_name, save_path = await run_in_threadpool(save_and_upload_to_supabase, file, session_id, "application/pdf")
     try:
-        with open(txt_path, "r", encoding="utf-8") as f:
-            content = f.read()
-        return PlainTextResponse(content, status_code=status.HTTP_200_OK)
+        result = await run_in_threadpool(process_files, [(file.filename, save_path)], session_id)
     except Exception as e:
-        print(f"Error reading common.txt: {e}")
-        raise HTTPException(
-            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-            detail=f"Failed to read common.txt: {e}"
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=str(e))
+    return {"message": "PDF uploaded and FAISS files created and uploaded", **result}
+
+
+@app.post("/upload-batch")
+async def upload_batch_endpoint(files: List[UploadFile] = File(...), session_id: Optional[str] = Form(None)):
+    """
+    Receives many PDFs and text files and indexes them together into one session,
+    extracting them in parallel.
+    """
+    session_id = require_session_id(session_id) if session_id else str(uuid4())
+    for file in files:
+        name = (file.filename or '').lower()
+        if not name.endswith('.pdf') and not name.endswith(TEXT_EXTENSIONS):
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"Unsupported file type: {file.filename}")
+
+    saved = []
+    names = unique_upload_names([file.filename for file in files])
+    for file, name in zip(files, names):
+        content_type = "application/pdf" if name.lower().endswith('.pdf') else "text/plain"
+        save_name, save_path = await run_in_threadpool(save_and_upload_to_supabase, file, session_id, content_type, name)
+        saved.append((name, save_path))
+    try:
+        result = await run_in_threadpool(process_files, saved, session_id)
+    except Exception as e:
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=str(e))
+    return {"message": "Files uploaded and FAISS files created and uploaded", "files": [name for name, _ in saved], **result}
+
+
+async def cancel_on_disconnect(request: Request, deadline: Deadline):
+    """
+    Cancels `deadline` once the client disconnects. Starlette doesn't interrupt a handler
+    whose client went away, so this is what stops the query's remaining stages.
+    """
+    while not deadline.expired():
+        if await request.is_disconnected():
+            print("Client disconnected; cancelling query")
+            deadline.cancel()
+            return
+        await asyncio.sleep(DISCONNECT_POLL_SECONDS)
+
+
+@app.post("/query", response_model=QueryResponse)
+async def query_endpoint(request_data: QueryRequest, request: Request):
+    """
+    Answers a question against the currently loaded session.
+    Retrieval and the LLM call are blocking and run in the threadpool.
+    """
+    if rag_system.faiss_index is None:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="No session loaded.")
+    deadline = Deadline()
+    watcher = asyncio.create_task(cancel_on_disconnect(request, deadline))
+    try:
+        response, sources = await run_in_threadpool(
+            rag_system.get_response_from_query,
+            request_data.message,
+            request_data.conversation_id,
+            filters=request_data.filters,
+            deadline=deadline
         )
+    except DeadlineExceeded as e:
+        raise HTTPException(status_code=status.HTTP_504_GATEWAY_TIMEOUT, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=str(e))
+    finally:
+        watcher.cancel()
+    return {"response": response, "degraded": deadline.degraded}
+
+
+@app.get("/llm-metrics")
+async def llm_metrics():
+    return {
+        "scheduler": rag_system.llm_scheduler.metrics(),
+        "single_flight": rag_system.single_flight.stats()
+    }
+
+
+@app.get("/session/{session_id}/document")
+async def get_session_document(session_id: str):
+    """
+    Returns document info for a session without its content or touching the FAISS index.
+    - If common.txt exists, returns it as a text document; its content is served
+      (with Range support) from content_url and as chunks from chunks_url.
+    - If only PDF exists, returns as PDF (no preview content).
+    """
+    try:
+        local_txt_path = await run_in_threadpool(storage.fetch_session_file, session_id, "common.txt")
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    except Exception:
+        # No common.txt; fall back to a PDF in the session folder
+        try:
+            pdf = await run_in_threadpool(find_session_pdf, session_id)
+        except Exception as e:
+            raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=str(e))
+        if not pdf:
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="No document found for this session.")
+        return {"id": session_id, "type": "pdf", "content": None, **pdf}
+    return {
+        "id": session_id,
+        "name": "common.txt",
+        "type": "text",
+        "size": os.path.getsize(local_txt_path),
+        "content": None,
+        "content_url": f"/session/{session_id}/document/content",
+        "chunks_url": f"/session/{session_id}/chunks"
+    }
+
+
+@app.get("/session/{session_id}/document/content", response_class=FileResponse)
+async def get_session_document_content(session_id: str):
+    """Streams a session's common.txt; Range requests get 206 partial content."""
+    try:
+        local_txt_path = await run_in_threadpool(storage.fetch_session_file, session_id, "common.txt")
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    except Exception:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="No text document found for this session.")
+    return FileResponse(local_txt_path, media_type="text/plain; charset=utf-8")
+
+
+@app.get("/session/{session_id}/chunks")
+async def get_session_chunks(session_id: str, offset: int = 0, limit: int = 50):
+    """Pages through a session's indexed chunks (from meta.json)."""
+    offset = max(offset, 0)
+    limit = min(max(limit, 1), 200)
+    try:
+        chunks = await run_in_threadpool(storage.load_session_chunks, session_id)
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=str(e))
+    return {
+        "session_id": session_id,
+        "offset": offset,
+        "limit": limit,
+        "total": len(chunks),
+        "chunks": [{"id": offset + i, **chunk} for i, chunk in enumerate(chunks[offset:offset + limit])]
+    }
         
         
+@app.post("/load_session")
+async def load_session_sync_endpoint(request_data: LoadSessionRequest):
+    """
+    Same as /load-session but waits for the session to be loaded, matching the Flask server,
+    so a /query sent right after it sees the new session.
+    """
+    if not supabase:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Supabase client not initialized. Cannot load session."
+        )
+    session_id = require_session_id(request_data.session_id)
+    try:
+        session_dir = await run_in_threadpool(load_session, session_id)
+    except Exception as e:
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=str(e))
+    return {
+        "message": "Files downloaded successfully",
+        "saved_to": session_dir,
+        "files": list(SESSION_FILES)
+    }
+
 @app.post("/load-session", status_code=status.HTTP_202_ACCEPTED, response_model=LoadSessionResponse)
 async def load_session_endpoint(
     request_data: LoadSessionRequest,
@@ -332,7 +536,7 @@ async def load_session_endpoint(
 ):
     """
     Initiates the loading of a specified session's files (common.txt, faiss.idx, meta.json)
-    from Supabase storage into the local 'tmp' directory and loads them into the RAG system.
+    from Supabase storage into a directory of their own under 'tmp/sessions' and loads them into the RAG system.
     This operation runs as a background task.
     """
     session_id = request_data.session_id
@@ -342,6 +546,7 @@ async def load_session_endpoint(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="Missing 'session_id' in request body."
         )
+    require_session_id(session_id)
     
     if not supabase:
         raise HTTPException(
@@ -360,4 +565,4 @@ async def load_session_endpoint(
     
 # --- Run the Application ---
 if __name__ == "__main__":
-    uvicorn.run("main:app", host="0.0.0.0", port=8000, reload=True)
\ No newline at end of file
+    uvicorn.run("fastApiServer:app", host="0.0.0.0", port=8000, reload=True)
\ No newline at end of file
@@ -0,0 +1,464 @@
+import heapq
+import itertools
+import os
+import random
+import re
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, wait
+from typing import Any, Callable, Dict, Hashable, Optional
+
+from deadlines import Deadline, DeadlineExceeded, SharedDeadline
+
+# Lower number = served first
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BACKGROUND = 10
+
+# Hedge delay used until enough LLM latencies have been seen to estimate a p95
+DEFAULT_HEDGE_DELAY = float(os.getenv("LLM_HEDGE_DELAY", "5.0"))
+MIN_HEDGE_SAMPLES = 20
+# At most this fraction of hedged calls may send a second copy after the hedge delay
+HEDGE_BUDGET = float(os.getenv("LLM_HEDGE_BUDGET", "0.1"))
+
+
+def normalize_question(question: str) -> str:
+    """Lowercase, strip punctuation and collapse whitespace so trivially different phrasings share a key."""
+    question = re.sub(r"[^\w\s]", " ", question.lower())
+    return " ".join(question.split())
+
+
+class SingleFlight:
+    """
+    Merges identical in-flight calls: the first caller for a key runs the function,
+    everyone else arriving before it finishes waits for and shares its result.
+    Nothing is cached once the call completes.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls: Dict[Hashable, Future] = {}
+        self.leaders = 0
+        self.followers = 0
+
+    def do(self, key: Hashable, fn: Callable[..., Any], timeout: Optional[float] = None, deadline: Optional[Deadline] = None) -> Any:
+        """
+        `timeout` bounds how long a follower waits for the leader's result. With `deadline`, fn is
+        called with a SharedDeadline that the leader and every follower join: the shared call runs
+        until the latest of their deadlines and is cancelled only once all of them are, while a
+        follower stops waiting as soon as its own deadline passes or is cancelled.
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            if call is not None:
+                future, shared = call
+                self.followers += 1
+                leader = False
+            else:
+                future, shared = Future(), (SharedDeadline() if deadline else None)
+                self._calls[key] = (future, shared)
+                self.leaders += 1
+                leader = True
+            leave = shared.join(deadline) if shared and deadline else None
+
+        if not leader:
+            if deadline and timeout is None:
+                timeout = deadline.remaining()
+            cancelled = deadline.cancelled_future() if deadline else Future()
+            wait({future, cancelled}, timeout=timeout, return_when=FIRST_COMPLETED)
+            if not future.done():
+                if leave:
+                    leave()
+                raise DeadlineExceeded("Timed out waiting for an identical in-flight request")
+            return future.result()
+
+        try:
+            future.set_result(fn(shared) if shared else fn())
+        except BaseException as e:
+            future.set_exception(e)
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+        return future.result()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "in_flight": len(self._calls),
+                "leaders": self.leaders,
+                "followers": self.followers,
+            }
+
+
+class TokenBucket:
+    """Classic token bucket: `rate` tokens per second, holding at most `capacity`."""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._last) * self.rate)
+                self._last = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+class LLMCall(Future):
+    """Future for a scheduled call; `started` completes once a worker has taken it off the queue."""
+
+    def __init__(self):
+        super().__init__()
+        self.started = Future()
+        self.started_at = None  # when fn began running (after any token bucket wait)
+
+
+class LLMScheduler:
+    """
+    Runs LLM calls on a fixed pool of worker threads (the concurrency cap),
+    pulling from a priority queue and pacing starts with a token bucket.
+    """
+
+    def __init__(self, max_concurrency: int = 4, rate_per_sec: Optional[float] = None, burst: Optional[float] = None):
+        self.max_concurrency = max_concurrency
+        self.bucket = TokenBucket(rate_per_sec, burst or max(1.0, rate_per_sec)) if rate_per_sec else None
+        self._queue = []
+        self._seq = itertools.count()  # FIFO tie-break within a priority
+        self._cond = threading.Condition()
+        self._metrics_lock = threading.Lock()
+        self._queue_waits = []
+        self._service_times = []
+        self._max_samples = 1000
+        self.in_flight = 0
+        self.completed = 0
+        self.failed = 0
+        self.hedged_calls = 0
+        self.hedges = 0
+        self.hedges_skipped = 0
+        self.expired = 0
+
+        for i in range(max_concurrency):
+            threading.Thread(target=self._worker, name=f"llm-worker-{i}", daemon=True).start()
+
+    def submit(self, fn: Callable[[], Any], priority: int = PRIORITY_INTERACTIVE, deadline: Optional[Deadline] = None) -> LLMCall:
+        """Queues fn; if `deadline` has passed by the time a worker picks it up, it is dropped unrun."""
+        future = LLMCall()
+        with self._cond:
+            heapq.heappush(self._queue, (priority, next(self._seq), time.monotonic(), fn, future, deadline))
+            self._cond.notify()
+        return future
+
+    def run(self, fn: Callable[[], Any], priority: int = PRIORITY_INTERACTIVE) -> Any:
+        return self.submit(fn, priority).result()
+
+    def hedge_delay(self) -> float:
+        """p95 of recent LLM service times, or DEFAULT_HEDGE_DELAY until there are enough samples."""
+        with self._metrics_lock:
+            times = sorted(self._service_times)
+        if len(times) < MIN_HEDGE_SAMPLES:
+            return DEFAULT_HEDGE_DELAY
+        return times[int(0.95 * (len(times) - 1))]
+
+    def _can_hedge(self) -> bool:
+        """A hedge may only use an idle worker, and only within HEDGE_BUDGET of hedged calls."""
+        with self._cond:
+            queued = len(self._queue)
+        with self._metrics_lock:
+            idle = self.in_flight + queued < self.max_concurrency
+            return idle and self.hedges < HEDGE_BUDGET * self.hedged_calls
+
+    def run_hedged(self, fn: Callable[[], Any], priority: int = PRIORITY_INTERACTIVE, deadline: Optional[Deadline] = None) -> Any:
+        """
+        Runs fn and, if it has not finished within the p95 delay of a worker starting it,
+        races one more copy against it, provided a worker is idle and the hedge budget allows.
+        A failed first call is retried once regardless. Returns the first success. Raises
+        DeadlineExceeded if `deadline` passes or is cancelled first; the losing call is cancelled
+        if still queued or otherwise left to finish with its result discarded.
+        """
+        first = self.submit(fn, priority, deadline)
+        with self._metrics_lock:
+            self.hedged_calls += 1
+        # Every wait below also watches this, so a cancelled deadline wakes it straight away
+        cancelled = deadline.cancelled_future() if deadline else Future()
+        # The hedge clock starts when a worker runs the call: time spent queued or waiting on the
+        # token bucket says nothing about this call being slow, and a hedge would only queue too
+        wait({first.started, cancelled}, timeout=deadline.remaining() if deadline else None, return_when=FIRST_COMPLETED)
+        if not first.started.done():
+            first.cancel()
+            raise DeadlineExceeded("LLM call was still queued at the deadline")
+
+        pending = {first}
+        hedged = False
+        error = None
+        while True:
+            timeout = None
+            if not hedged and first.started_at is not None:
+                timeout = max(0.0, first.started_at + self.hedge_delay() - time.monotonic())
+            if deadline:
+                timeout = deadline.remaining() if timeout is None else min(timeout, deadline.remaining())
+            done, _ = wait(pending | {cancelled}, timeout=timeout, return_when=FIRST_COMPLETED)
+            for future in done - {cancelled}:
+                pending.discard(future)
+                if future.exception() is None:
+                    for other in pending:
+                        other.cancel()
+                    return future.result()
+                error = future.exception()
+
+            if deadline and deadline.expired():
+                for other in pending:
+                    other.cancel()
+                raise DeadlineExceeded("LLM call did not finish before the deadline")
+            if not hedged:
+                hedged = True
+                if error is None and not self._can_hedge():
+                    with self._metrics_lock:
+                        self.hedges_skipped += 1
+                    continue
+                with self._metrics_lock:
+                    self.hedges += 1
+                pending.add(self.submit(fn, priority, deadline))
+            elif not pending:
+                raise error
+
+    def _worker(self):
+        while True:
+            with self._cond:
+                while not self._queue:
+                    self._cond.wait()
+                _, _, enqueued_at, fn, future, deadline = heapq.heappop(self._queue)
+
+            try:
+                if not future.set_running_or_notify_cancel():
+                    continue
+                if deadline and deadline.expired():
+                    with self._metrics_lock:
+                        self.expired += 1
+                    future.set_exception(DeadlineExceeded("Deadline passed while queued for the LLM"))
+                    continue
+                if self.bucket:
+                    self.bucket.acquire()
+
+                with self._metrics_lock:
+                    self._queue_waits.append(time.monotonic() - enqueued_at)
+                    del self._queue_waits[:-self._max_samples]
+                    self.in_flight += 1
+                future.started_at = time.monotonic()
+            finally:
+                future.started.set_result(None)
+
+            try:
+                future.set_result(fn())
+                ok = True
+            except BaseException as e:
+                future.set_exception(e)
+                ok = False
+            with self._metrics_lock:
+                self._service_times.append(time.monotonic() - future.started_at)
+                del self._service_times[:-self._max_samples]
+                self.in_flight -= 1
+                if ok:
+                    self.completed += 1
+                else:
+                    self.failed += 1
+
+    def metrics(self) -> dict:
+        with self._cond:
+            queued = len(self._queue)
+        with self._metrics_lock:
+            waits = sorted(self._queue_waits)
+            in_flight, completed, failed = self.in_flight, self.completed, self.failed
+            hedged_calls, hedges, skipped, expired = self.hedged_calls, self.hedges, self.hedges_skipped, self.expired
+
+        def pct(p):
+            return round(waits[min(len(waits) - 1, int(p * len(waits)))] * 1000, 2) if waits else 0.0
+
+        return {
+            "max_concurrency": self.max_concurrency,
+            "queued": queued,
+            "in_flight": in_flight,
+            "completed": completed,
+            "failed": failed,
+            "hedged_calls": hedged_calls,
+            "hedges": hedges,
+            "hedges_skipped": skipped,
+            "expired_in_queue": expired,
+            "hedge_delay_ms": round(self.hedge_delay() * 1000, 2),
+            "queue_wait_ms": {
+                "mean": round(sum(waits) / len(waits) * 1000, 2) if waits else 0.0,
+                "p50": pct(0.50),
+                "p95": pct(0.95),
+                "max": round(waits[-1] * 1000, 2) if waits else 0.0,
+            },
+        }
+
+
+def scheduler_from_env() -> LLMScheduler:
+    rate = os.getenv("LLM_RATE_PER_SEC")
+    burst = os.getenv("LLM_BURST")
+    return LLMScheduler(
+        max_concurrency=int(os.getenv("LLM_MAX_CONCURRENCY", "4")),
+        rate_per_sec=float(rate) if rate else None,
+        burst=float(burst) if burst else None,
+    )
+
+
+class StubLLM:
+    """Local stand-in for Gemini with configurable latency, latency spikes and failure rate."""
+
+    def __init__(self, latency: float = 0.5, jitter: float = 0.0, failure_rate: float = 0.0, spike_rate: float = 0.0, spike_latency: float = 5.0):
+        self.latency = latency
+        self.jitter = jitter
+        self.failure_rate = failure_rate
+        self.spike_rate = spike_rate
+        self.spike_latency = spike_latency
+        self.calls = 0
+        self.active = 0
+        self.max_active = 0  # highest number of calls seen running at once
+        self._lock = threading.Lock()
+
+    def invoke(self, prompt: str) -> str:
+        with self._lock:
+            self.calls += 1
+            self.active += 1
+            self.max_active = max(self.max_active, self.active)
+        try:
+            spike = self.spike_latency if random.random() < self.spike_rate else 0.0
+            time.sleep(max(0.0, self.latency + spike + random.uniform(-self.jitter, self.jitter)))
+            if random.random() < self.failure_rate:
+                raise RuntimeError("StubLLM: injected failure")
+            return f"stub answer to: {prompt[:60]}"
+        finally:
+            with self._lock:
+                self.active -= 1
+
+
+if __name__ == "__main__":
+    from concurrent.futures import ThreadPoolExecutor
+
+    questions = ["What is the cutoff for CSE?", "what is the cutoff for cse", "Tell me about hostels."]
+
+    def ask_all(stub, scheduler, single_flight, n=30):
+        """Fires n concurrent questions (cycling through `questions`); failures are returned, not raised."""
+        def ask(i):
+            q = questions[i % len(questions)]
+            key = ("demo-session", normalize_question(q))
+            try:
+                return single_flight.do(key, lambda: scheduler.run(lambda: stub.invoke(q)))
+            except RuntimeError as e:
+                return e
+
+        with ThreadPoolExecutor(max_workers=n) as pool:
+            return list(pool.map(ask, range(n)))
+
+    # 1. Identical in-flight questions share one call per normalized key
+    stub = StubLLM(latency=0.2)
+    scheduler = LLMScheduler(max_concurrency=3, rate_per_sec=20, burst=5)
+    single_flight = SingleFlight()
+    start = time.monotonic()
+    answers = ask_all(stub, scheduler, single_flight)
+    print(f"30 requests answered in {time.monotonic() - start:.2f}s with {stub.calls} LLM calls")
+    print("single-flight:", single_flight.stats())
+    print("scheduler:", scheduler.metrics())
+    assert stub.calls == len({normalize_question(q) for q in questions}) == 2, stub.calls
+    assert all(isinstance(a, str) for a in answers)
+    assert single_flight.stats() == {"in_flight": 0, "leaders": 2, "followers": 28}
+
+    # 2. Stub failures reach the leader and every follower
+    failing = StubLLM(latency=0.2, failure_rate=1.0)
+    answers = ask_all(failing, LLMScheduler(max_concurrency=3), SingleFlight())
+    assert failing.calls == 2, failing.calls
+    assert all(isinstance(a, RuntimeError) for a in answers), answers
+
+    # 3. The scheduler never runs more calls at once than its cap
+    capped = StubLLM(latency=0.05)
+    scheduler = LLMScheduler(max_concurrency=3)
+    futures = [scheduler.submit(lambda: capped.invoke("q")) for _ in range(20)]
+    wait(futures)
+    assert capped.calls == 20 and capped.max_active == 3, (capped.calls, capped.max_active)
+    assert scheduler.metrics()["completed"] == 20
+    print("single-flight and concurrency-cap checks passed")
+
+    # Tail latency with 3% injected 2 s spikes: plain calls vs. hedged calls under a 1.5 s deadline,
+    # first with spare workers, then saturated (default cap of 4, 8 callers, 200 ms calls)
+    def p99(latencies):
+        return sorted(latencies)[int(0.99 * (len(latencies) - 1))] * 1000
+
+    for concurrency, latency, calls in ((16, 0.05, 400), (4, 0.2, 200)):
+        print(f"max_concurrency {concurrency}, 8 callers, {latency * 1000:.0f} ms calls:")
+        for label, hedged in (("plain", False), ("hedged", True)):
+            spiky = StubLLM(latency=latency, jitter=0.01, spike_rate=0.03, spike_latency=2.0)
+            scheduler = LLMScheduler(max_concurrency=concurrency)
+            latencies, misses = [], []
+
+            def call(_):
+                start = time.monotonic()
+                try:
+                    if hedged:
+                        scheduler.run_hedged(lambda: spiky.invoke("q"), deadline=Deadline(1.5))
+                    else:
+                        scheduler.run(lambda: spiky.invoke("q"))
+                except DeadlineExceeded:
+                    misses.append(1)
+                latencies.append(time.monotonic() - start)
+
+            with ThreadPoolExecutor(max_workers=8) as pool:
+                list(pool.map(call, range(calls)))
+            print(f"  {label:>6}: p50 {sorted(latencies)[len(latencies) // 2] * 1000:.0f} ms, p99 {p99(latencies):.0f} ms, "
+                  f"hedge rate {scheduler.hedges / calls:.1%}, extra calls {spiky.calls - calls}, "
+                  f"deadline misses {len(misses)}")
+            if hedged:
+                assert scheduler.hedges <= HEDGE_BUDGET * calls, scheduler.hedges
+
+    # 4. Cancelling a deadline wakes run_hedged right away, whether the call is running or still queued
+    slow = StubLLM(latency=7.0)
+    scheduler = LLMScheduler(max_concurrency=1)
+    for label in ("running", "queued"):
+        deadline = Deadline(30)
+        threading.Timer(0.5, deadline.cancel).start()
+        start = time.monotonic()
+        try:
+            scheduler.run_hedged(lambda: slow.invoke("q"), deadline=deadline)
+        except DeadlineExceeded:
+            pass
+        waited = time.monotonic() - start
+        print(f"cancel while {label}: noticed after {waited:.2f}s")
+        assert waited < 1.0, waited
+
+    # 5. A shared answer survives the leader's client going away, and stops once every client has
+    shared_stub = StubLLM(latency=1.0)
+    for cancel_all in (False, True):
+        single_flight, scheduler = SingleFlight(), LLMScheduler()
+        deadlines = [Deadline(30), Deadline(30)]
+        threading.Timer(0.3, deadlines[0].cancel).start()
+        if cancel_all:
+            threading.Timer(0.4, deadlines[1].cancel).start()
+
+        def ask_shared(deadline):
+            start = time.monotonic()
+            try:
+                answer = single_flight.do("key", lambda shared: scheduler.run_hedged(lambda: shared_stub.invoke("q"), deadline=shared), deadline=deadline)
+            except DeadlineExceeded as e:
+                answer = e
+            return answer, time.monotonic() - start
+
+        with ThreadPoolExecutor(max_workers=2) as pool:
+            leader_future = pool.submit(ask_shared, deadlines[0])
+            time.sleep(0.05)
+            follower_future = pool.submit(ask_shared, deadlines[1])
+            leader_answer, _ = leader_future.result()
+            follower_answer, follower_waited = follower_future.result()
+        print(f"leader cancelled{' then follower' if cancel_all else ''}: follower got {type(follower_answer).__name__} after {follower_waited:.2f}s")
+        if cancel_all:
+            assert isinstance(follower_answer, DeadlineExceeded) and follower_waited < 0.6, (follower_answer, follower_waited)
+            assert isinstance(leader_answer, DeadlineExceeded), leader_answer
+        else:
+            assert isinstance(follower_answer, str) and isinstance(leader_answer, str), (leader_answer, follower_answer)
@@ -0,0 +1,113 @@
+import json
+import os
+import re
+import shutil
+import tempfile
+from functools import lru_cache
+from uuid import uuid4
+
+from artifact_codec import compress_file, decode_to_file, DEFAULT_CODEC
+
+# Session artifacts fetched for previews are cached here, separate from the loaded RAG session
+SESSION_CACHE_DIR = os.path.join(tempfile.gettempdir(), "documind_sessions")
+# Artifacts every indexed session has in storage
+SESSION_FILES = ("common.txt", "faiss.idx", "meta.json")
+_SESSION_ID_RE = re.compile(r"[A-Za-z0-9_-]{1,128}")
+
+
+def validate_session_id(session_id) -> str:
+    """
+    Session ids come from clients and end up in local paths and storage keys, so only plain
+    names (letters, digits, "_" and "-", as in the uuid4 ids the servers hand out) are accepted.
+    Raises ValueError otherwise.
+    """
+    if not isinstance(session_id, str) or not _SESSION_ID_RE.fullmatch(session_id):
+        raise ValueError(f"Invalid session_id: {session_id!r}")
+    return session_id
+
+
+class SessionStorage:
+    """
+    Supabase storage access shared by the Flask and FastAPI servers: compressed uploads and
+    downloads of session artifacts, plus the local preview cache. All methods are blocking.
+    """
+
+    def __init__(self, client, bucket: str, cache_dir: str = SESSION_CACHE_DIR, raise_upload_errors: bool = True):
+        self.client = client
+        self.bucket = bucket
+        self.raise_upload_errors = raise_upload_errors  # False: failed uploads are only logged
+        self.cache_dir = cache_dir
+        # Parsed meta.json chunks of the most recently previewed sessions
+        self.load_session_chunks = lru_cache(maxsize=8)(self._load_session_chunks)
+
+    def upload(self, local_path: str, storage_path: str, content_type: str, compress: bool = True):
+        """
+        Uploads a local file. Session artifacts are zstd-compressed on the way up (see artifact_codec);
+        the header inside the object records the codec, so download() can undo it transparently.
+        """
+        if not self.client:
+            print(f"Skipping upload to Supabase: Supabase client not initialized. File: {local_path}")
+            return
+
+        source_path, compressed_path = local_path, None
+        if compress and DEFAULT_CODEC == "zstd":
+            compressed_path = f"{local_path}.zst"
+            compress_file(local_path, compressed_path)
+            local_path, content_type = compressed_path, "application/zstd"
+        try:
+            with open(local_path, "rb") as f:
+                self.client.storage.from_(self.bucket).upload(storage_path, f, {
+                    "content-type": content_type,
+                    "x-upsert": "true"
+                })
+            print(f"Successfully uploaded {source_path} to Supabase at {storage_path}")
+        except Exception as e:
+            if self.raise_upload_errors:
+                raise
+            print(f"Error uploading {source_path} to Supabase: {e}")
+        finally:
+            if compressed_path and os.path.exists(compressed_path):
+                os.remove(compressed_path)
+
+    def download(self, storage_path: str, local_path: str):
+        """Downloads an object to local_path, decompressing it if it was stored compressed."""
+        if not self.client:
+            raise RuntimeError("Supabase client not initialized. Cannot download files.")
+        res = self.client.storage.from_(self.bucket).download(storage_path)
+        decode_to_file(res, local_path)
+
+    def download_session(self, session_id: str, root: str) -> str:
+        """
+        Downloads all SESSION_FILES of a session into a new directory under `root` and returns
+        its path. Every call gets its own directory, so loading a session never disturbs files
+        other requests (uploads in progress, another loaded session) are still using.
+        """
+        local_dir = os.path.join(root, f"{validate_session_id(session_id)}_{uuid4().hex}")
+        os.makedirs(local_dir)
+        try:
+            for file_name in SESSION_FILES:
+                self.download(f"{session_id}/{file_name}", os.path.join(local_dir, file_name))
+        except Exception:
+            shutil.rmtree(local_dir, ignore_errors=True)
+            raise
+        return local_dir
+
+    def fetch_session_file(self, session_id: str, file_name: str) -> str:
+        """Downloads a session artifact once; later reads are served from the local cache."""
+        local_dir = os.path.join(self.cache_dir, validate_session_id(session_id))
+        local_path = os.path.join(local_dir, file_name)
+        if not os.path.exists(local_path):
+            os.makedirs(local_dir, exist_ok=True)
+            part_path = f"{local_path}.{uuid4().hex}.part"
+            self.download(f"{session_id}/{file_name}", part_path)
+            os.replace(part_path, local_path)
+        return local_path
+
+    def _load_session_chunks(self, session_id: str) -> list:
+        with open(self.fetch_session_file(session_id, "meta.json"), "r", encoding="utf-8") as f:
+            return json.load(f)["chunks"]
+
+    def invalidate(self, session_id: str):
+        """Drops cached artifacts of a session that has just been re-uploaded."""
+        shutil.rmtree(os.path.join(self.cache_dir, validate_session_id(session_id)), ignore_errors=True)
+        self.load_session_chunks.cache_clear()
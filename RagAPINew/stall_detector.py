@@ -0,0 +1,59 @@
+import asyncio
+import logging
+import sys
+import threading
+import time
+import traceback
+
+logger = logging.getLogger("stall_detector")
+
+
+class EventLoopStallDetector:
+    """
+    Debug aid that reports anything blocking the event loop for longer than `threshold` seconds.
+
+    Two complementary signals:
+    - asyncio debug mode with slow_callback_duration logs the task/callback that ran too long
+      once it finishes (logger "asyncio").
+    - A watchdog thread watches a heartbeat scheduled on the loop; when the heartbeat goes stale
+      it logs the loop thread's current stack, so a call that never returns is still caught.
+    """
+
+    def __init__(self, threshold: float = 0.1):
+        self.threshold = threshold
+        self.stalls = 0
+        self._loop = None
+        self._loop_thread_id = None
+        self._last_beat = time.monotonic()
+        self._stopped = threading.Event()
+
+    def start(self, loop: asyncio.AbstractEventLoop = None):
+        self._loop = loop or asyncio.get_running_loop()
+        self._loop.set_debug(True)
+        self._loop.slow_callback_duration = self.threshold
+        logging.getLogger("asyncio").setLevel(logging.WARNING)
+        self._loop_thread_id = threading.get_ident()
+        self._loop.call_soon(self._beat)
+        threading.Thread(target=self._watch, name="loop-stall-watchdog", daemon=True).start()
+        logger.warning(f"Event loop stall detector enabled (threshold {self.threshold * 1000:.0f} ms)")
+
+    def stop(self):
+        self._stopped.set()
+
+    def _beat(self):
+        self._last_beat = time.monotonic()
+        if not self._stopped.is_set():
+            self._loop.call_later(self.threshold / 4, self._beat)
+
+    def _watch(self):
+        reported_beat = None
+        while not self._stopped.wait(self.threshold / 2):
+            beat = self._last_beat
+            blocked_for = time.monotonic() - beat
+            # Report each stall once, while it is still happening
+            if blocked_for > self.threshold and beat != reported_beat:
+                reported_beat = beat
+                self.stalls += 1
+                frame = sys._current_frames().get(self._loop_thread_id)
+                stack = "".join(traceback.format_stack(frame)) if frame else "<unavailable>"
+                logger.warning(f"Event loop blocked for more than {blocked_for * 1000:.0f} ms; loop thread is at:\n{stack}")
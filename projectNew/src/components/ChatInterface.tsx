@@ -35,6 +35,14 @@ export function ChatInterface() {
         setDocument(doc);
       } catch (e) {
         setDocument(null);
+        return;
+      }
+      // Fetching document info no longer loads the index, so load it for querying.
+      // A failure here (e.g. a PDF-only session) must not hide the document.
+      try {
+        await apiClient.loadSession(sessionId);
+      } catch (e) {
+        console.error("Error loading session:", e);
       }
     }
     fetchDocument();
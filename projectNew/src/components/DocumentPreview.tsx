@@ -1,13 +1,39 @@
-import React, { useEffect, useState } from 'react';
+import React, { useEffect, useRef, useState } from 'react';
 import { useParams } from 'react-router-dom';
 import { LoadingSpinner } from './LoadingSpinner';
 import type { Document } from '../types';
 import { apiClient } from '../utils/api';
 
+// Text documents are fetched in byte ranges of this size instead of all at once
+const PREVIEW_PAGE_BYTES = 64 * 1024;
+
 export function DocumentPreview() {
   const { sessionId } = useParams();
   const [document, setDocument] = useState<Document | null>(null);
   const [loading, setLoading] = useState(false);
+  const [content, setContent] = useState('');
+  const [loadedBytes, setLoadedBytes] = useState(0);
+  const [totalBytes, setTotalBytes] = useState(0);
+  const [loadingMore, setLoadingMore] = useState(false);
+  // Streaming decoder so multi-byte characters split across ranges decode correctly
+  const decoderRef = useRef(new TextDecoder('utf-8'));
+
+  const loadMore = async (start: number) => {
+    if (!sessionId) return;
+    setLoadingMore(true);
+    try {
+      const { bytes, total } = await apiClient.getDocumentContentRange(sessionId, start, PREVIEW_PAGE_BYTES);
+      const end = start + bytes.length;
+      const text = decoderRef.current.decode(bytes, { stream: end < total });
+      setContent(prev => (start === 0 ? text : prev + text));
+      setLoadedBytes(end);
+      setTotalBytes(total);
+    } catch (e) {
+      console.error("Error fetching document content:", e);
+    } finally {
+      setLoadingMore(false);
+    }
+  };
 
   useEffect(() => {
     async function fetchDocument() {
@@ -17,7 +43,12 @@ export function DocumentPreview() {
         // Use the same API as ChatInterface
         const doc = await apiClient.getDocumentBySessionId(sessionId);
         setDocument(doc);
-        console.log("Fetched document:", doc);
+        setContent('');
+        setLoadedBytes(0);
+        decoderRef.current = new TextDecoder('utf-8');
+        if (doc.type === 'text') {
+          await loadMore(0);
+        }
       } catch (e) {
         setDocument(null);
         console.error("Error fetching document:", e);
@@ -40,14 +71,23 @@ export function DocumentPreview() {
     <div className="bg-white/10 dark:bg-gray-800/50 backdrop-blur-lg rounded-2xl p-6 border border-white/20 dark:border-gray-700/50 h-full">
       <h2 className="text-xl font-semibold text-white mb-4">Document Preview</h2>
       <div className="p-4 h-full overflow-y-auto">
-        {document.type === 'text' && document.content ? (
+        {document.type === 'text' && content ? (
           <div className="prose prose-invert max-w-none">
             <pre
               className="text-gray-300 text-sm whitespace-pre-wrap font-sans leading-relaxed max-h-[60vh] overflow-y-auto w-full pr-2 scrollbar-thin scrollbar-thumb-gray-700 scrollbar-track-transparent"
               style={{ direction: 'ltr', overflowX: 'hidden' }}
             >
-              {document.content}
+              {content}
             </pre>
+            {loadedBytes < totalBytes && (
+              <button
+                onClick={() => loadMore(loadedBytes)}
+                disabled={loadingMore}
+                className="mt-3 px-4 py-2 text-sm rounded-lg bg-blue-600 hover:bg-blue-700 text-white disabled:opacity-50"
+              >
+                {loadingMore ? 'Loading...' : `Load more (${Math.round((loadedBytes / totalBytes) * 100)}% shown)`}
+              </button>
+            )}
           </div>
         ) : (
           <div className="flex items-center justify-center h-full text-center">
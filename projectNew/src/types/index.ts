@@ -11,7 +11,9 @@ export interface Document {
   name: string;
   size: number;
   type: 'pdf' | 'text';
-  content?: string;
+  content?: string | null;
+  content_url?: string;
+  chunks_url?: string;
   uploadProgress?: number;
 }
 
@@ -94,6 +94,18 @@ class APIClient {
     return await res.json();
   }
 
+  // Fetch one byte range of a session's text document; `total` comes from Content-Range
+  async getDocumentContentRange(sessionId: string, start: number, length: number): Promise<{ bytes: Uint8Array; total: number }> {
+    const res = await fetch(`${this.baseURL}/session/${sessionId}/document/content`, {
+      headers: { Range: `bytes=${start}-${start + length - 1}` }
+    });
+    if (!res.ok) throw new Error('Failed to fetch document content');
+    const bytes = new Uint8Array(await res.arrayBuffer());
+    const contentRange = res.headers.get('Content-Range');
+    const total = contentRange ? Number(contentRange.split('/')[1]) : bytes.length;
+    return { bytes, total };
+  }
+
   async checkHealth(): Promise<boolean> {
     try {
       const response = await fetch(`${this.baseURL}${API_ENDPOINTS.HEALTH}`);
@@ -120,18 +132,20 @@ class APIClient {
     }
   }
 
-  async loadSession(sessionId: string): Promise<string> {
+  // Load a session's index on the server so it can be queried; its text is
+  // fetched separately, in ranges, by getDocumentContentRange
+  async loadSession(sessionId: string): Promise<void> {
+    let res: Response;
     try {
-      await fetch(`${this.baseURL}/load_session`, {
+      res = await fetch(`${this.baseURL}/load_session`, {
         method: 'POST',
         headers: { 'Content-Type': 'application/json' },
         body: JSON.stringify({ session_id: sessionId })
       });
-      const txtRes = await fetch(`${this.baseURL}/get-common-txt?session_id=${encodeURIComponent(sessionId)}`);
-      return await txtRes.text();
     } catch (error) {
       throw new Error('Failed to load session.');
     }
+    if (!res.ok) throw new Error('Failed to load session.');
   }
 
 